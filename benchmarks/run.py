@@ -0,0 +1,243 @@
+"""Benchmark gfont against the local stand-in for Google Fonts endpoints
+
+Results are written as json, so runs of different versions can be compared:
+
+    python benchmarks/run.py --output before.json
+    git checkout <other version>
+    python benchmarks/run.py --output after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from server import Config, environment, start_server
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT_DIR, "src")
+
+BENCHMARKS = ["cold_start_refresh", "cold_start", "search", "install_single", "install_many", "webfont_pack"]
+SEARCH_QUERIES = [["sans"], ["noto", "sans"], ["mono"], ["roboto"], ["serif", "display"], ["zzzz"]]
+
+
+def summarize(samples: List[float]) -> Optional[Dict]:
+    if not samples:
+        return None
+
+    samples = sorted(samples)
+
+    return {
+        "runs": len(samples),
+        "min": samples[0],
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "p95": samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+        "max": samples[-1],
+    }
+
+
+def measure(func: Callable, repeat: int, setup: Callable = lambda: None) -> Tuple[List[float], List[str]]:
+    """Run {func} {repeat} times, failed runs (e.g. injected errors) are collected instead of samples
+
+    :return: Durations of successful runs and errors of failed runs
+    """
+
+    samples = []
+    errors = []
+
+    for _i in range(repeat):
+        setup()
+        start = time.perf_counter()
+
+        try:
+            func()
+        except Exception as error:
+            errors.append(f"{type(error).__name__}: {error}")
+        else:
+            samples.append(time.perf_counter() - start)
+
+    return samples, errors
+
+
+def run_gfont(*args: str):
+    process = subprocess.run([sys.executable, "-m", "gfont", *args], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, env=os.environ)
+
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"gfont exited with {process.returncode}")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: Dict, baseline: Dict):
+    print(f"{'benchmark':<22}{'baseline':>12}{'current':>12}{'change':>10}", file=sys.stderr)
+
+    for [name, result] in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+
+        if not baseline["results"][name]["seconds"] or not result["seconds"]:
+            continue
+
+        before = baseline["results"][name]["seconds"]["median"]
+        after = result["seconds"]["median"]
+        print(f"{name:<22}{before:>12.4f}{after:>12.4f}{(after - before) / before * 100:>+9.1f}%", file=sys.stderr)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark gfont against a local stand-in for Google Fonts endpoints")
+    argparser.add_argument("--output", help="write results into this file instead of stdout")
+    argparser.add_argument("--compare", metavar="BASELINE", help="print changes against results of a previous run")
+    argparser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS, help="benchmarks to run")
+    argparser.add_argument("--repeat", type=int, default=5, help="repeats of cold start and install benchmarks")
+    argparser.add_argument("--families", type=int, default=60, help="number of families for install_many")
+    argparser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    argparser.add_argument("--bandwidth", type=int, default=0, help="bytes per second per response, 0 for unlimited")
+    argparser.add_argument("--error-rate", type=float, default=0.0, help="probability to answer with 503")
+    argparser.add_argument("--font-size", type=int, default=100 * 1024, help="size of generated font files")
+    args = argparser.parse_args()
+
+    config = Config(args.latency, args.bandwidth, args.error_rate, args.font_size)
+    server, base_url = start_server(config)
+    home = tempfile.mkdtemp(prefix="gfont-benchmark-")
+
+    # gfont reads its directories and endpoints at import time
+    os.environ.update(environment(base_url))
+    os.environ["HOME"] = home
+    os.environ["PYTHONPATH"] = SRC_DIR
+    os.environ.pop("GOOGLE_FONTS_API_KEY", None)
+    sys.path.insert(0, SRC_DIR)
+
+    from gfont import gfontlibs as libs
+    from gfont.constants import CACHE_FILE, FONTS_DIR, VERSION
+
+    results: Dict[str, Dict] = {}
+
+    def record(name: str, measured: Tuple[List[float], List[str]], **extra):
+        [samples, errors] = measured
+        results[name] = {"seconds": summarize(samples), "successful_runs": len(samples), "errors": errors, **extra}
+
+    def remove_cache():
+        if os.path.isfile(CACHE_FILE):
+            os.remove(CACHE_FILE)
+
+    def remove_fonts():
+        shutil.rmtree(FONTS_DIR, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def without_errors():
+        """Preparation steps aren't measured, so errors aren't injected into them"""
+
+        error_rate = config.error_rate
+        config.error_rate = 0.0
+        try:
+            yield
+        finally:
+            config.error_rate = error_rate
+
+    try:
+        # Output of gfont itself isn't part of the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            if "cold_start_refresh" in args.only:
+                record("cold_start_refresh", measure(lambda: run_gfont("list", "--all"), args.repeat, remove_cache))
+
+            with without_errors():
+                if "cold_start" in args.only:
+                    run_gfont("list", "--all")
+                families = libs.get_families()
+
+            if "cold_start" in args.only:
+                record("cold_start", measure(lambda: run_gfont("list", "--all"), args.repeat))
+
+            if "search" in args.only:
+                samples = []
+
+                for keywords in SEARCH_QUERIES * 20:
+                    samples += measure(lambda: libs.search_families(keywords), 1)[0]
+
+                record("search", (samples, []), catalog_size=len(families))
+
+            if "install_single" in args.only:
+                family = "Roboto" if "Roboto" in families else families[0]
+                sent_bytes = config.sent_bytes
+                measured = measure(lambda: libs.install_family(family, True), args.repeat, remove_fonts)
+                record("install_single", measured, family=family, files=len(libs.get_font_files(family)), bytes=(config.sent_bytes - sent_bytes) // args.repeat)
+
+            if "install_many" in args.only:
+                selected = families[:args.families]
+                errors = []
+                sent_bytes = config.sent_bytes
+
+                def _install_many():
+                    for family in selected:
+                        try:
+                            libs.install_family(family, True)
+                        except Exception as error:
+                            errors.append(f"{family}: {type(error).__name__}: {error}")
+
+                remove_fonts()
+                [samples, _errors] = measure(_install_many, 1)
+                received = config.sent_bytes - sent_bytes
+                record(
+                    "install_many",
+                    (samples, errors),
+                    families=len(selected),
+                    installed_families=len(selected) - len(errors),
+                    bytes=received,
+                    families_per_second=(len(selected) - len(errors)) / samples[0],
+                    bytes_per_second=received / samples[0],
+                )
+
+            if "webfont_pack" in args.only:
+                selected = families[:10]
+                webfonts_dir = os.path.join(home, "webfonts")
+                measured = measure(lambda: [libs.pack_webfonts(family, True, webfonts_dir, True, "ital,wght@0,400;0,700;1,400") for family in selected], args.repeat)
+                record("webfont_pack", measured, families=len(selected))
+    finally:
+        server.shutdown()
+        shutil.rmtree(home, ignore_errors=True)
+
+    output = {
+        "gfont_version": VERSION,
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "latency": args.latency,
+            "bandwidth": args.bandwidth,
+            "error_rate": args.error_rate,
+            "font_size": args.font_size,
+            "repeat": args.repeat,
+        },
+        "server": {"requests": config.requests, "errors": config.errors, "sent_bytes": config.sent_bytes},
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=4)
+    else:
+        print(json.dumps(output, indent=4))
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            compare(output, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
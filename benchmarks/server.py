@@ -0,0 +1,241 @@
+"""Local stand-in for Google Fonts endpoints used by gfont
+
+Serves the webfonts API, the raw webfonts.json data, the metadata endpoint,
+css/css2 and gstatic-like font files generated from data/webfonts.json,
+with configurable latency, bandwidth and error injection.
+
+Run standalone with `python benchmarks/server.py --port 8000`, then point gfont to it:
+
+    GFONT_WEBFONTS_DATA_URL=http://127.0.0.1:8000/webfonts.json
+    GFONT_WEBFONTS_API_URL=http://127.0.0.1:8000/webfonts/v1/webfonts
+    GFONT_METADATA_URL=http://127.0.0.1:8000/metadata/fonts
+    GFONT_CSS_API_URL=http://127.0.0.1:8000
+    GFONT_CONNECTIVITY_CHECK_ADDRESS=127.0.0.1:8000
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "webfonts.json")
+
+
+def kebab_case(text: str):
+    return text.lower().replace(" ", "-")
+
+
+def make_font(seed: str, size: int, woff2: bool) -> bytes:
+    """Generate deterministic font-like bytes with a valid sfnt or WOFF2 header"""
+
+    body = (seed.encode() * (size // max(len(seed), 1) + 1))[:max(size - 28, 0)]
+
+    if woff2:
+        header = b"wOF2" + b"\x00\x01\x00\x00" + struct.pack(">I", 12 + len(body))
+        return header + body
+
+    # sfnt header with a single table covering the whole body
+    header = b"\x00\x01\x00\x00" + struct.pack(">HHHH", 1, 16, 0, 0)
+    header += b"glyf" + struct.pack(">III", 0, 28, len(body))
+    return header + body
+
+
+def make_axes(item: Dict) -> List[Dict]:
+    """Families with many upright weights are treated as variable fonts with a weight axis"""
+
+    weights = [int(x) for x in ["100", "200", "300", "400", "500", "600", "700", "800", "900"] if x in item["variants"] or (x == "400" and "regular" in item["variants"])]
+
+    if len(weights) < 5:
+        return []
+
+    return [{"tag": "wght", "min": float(min(weights)), "max": float(max(weights)), "defaultValue": 400.0}]
+
+
+class Config:
+    def __init__(self, latency: float = 0.0, bandwidth: int = 0, error_rate: float = 0.0, font_size: int = 100 * 1024, seed: int = 0):
+        """
+        :param latency: seconds to wait before each response
+        :param bandwidth: bytes per second per response, 0 for unlimited
+        :param error_rate: probability (0 to 1) to answer with 503 instead
+        :param font_size: size of every generated font file
+        """
+
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.font_size = font_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.sent_bytes = 0
+
+
+def load_catalog(base_url: str) -> Dict:
+    """Load data/webfonts.json and rewrite font urls to point at the local server"""
+
+    with open(DATA_FILE, "r") as file:
+        catalog = json.load(file)
+
+    for item in catalog["items"]:
+        prefix = f"{base_url}/s/{kebab_case(item['family'])}"
+        item["files"] = {variant: f"{prefix}/{variant}.ttf" for variant in item["files"]}
+        item["menu"] = f"{prefix}/menu.ttf"
+
+    return catalog
+
+
+def make_handler(config: Config, catalog: Dict):
+    catalog_bytes = json.dumps(catalog).encode()
+    families = {item["family"]: item for item in catalog["items"]}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = urllib.parse.parse_qs(url.query)
+
+            with config.lock:
+                config.requests += 1
+                failed = config.random.random() < config.error_rate
+                config.errors += failed
+
+            if config.latency:
+                time.sleep(config.latency)
+
+            if failed:
+                return self.respond(503, b"Service Unavailable", "text/plain")
+
+            if url.path in ["/webfonts.json", "/webfonts/v1/webfonts"]:
+                return self.respond(200, catalog_bytes, "application/json")
+
+            if url.path == "/metadata/fonts":
+                metadata = {"familyMetadataList": [{"family": x, "designers": ["Local Designer"], "axes": make_axes(y)} for [x, y] in families.items()]}
+                return self.respond(200, (")]}'\n" + json.dumps(metadata)).encode(), "application/json")
+
+            if url.path.startswith("/metadata/fonts/"):
+                family = urllib.parse.unquote(url.path[len("/metadata/fonts/"):])
+                if family not in families:
+                    return self.respond(404, b"Not Found", "text/plain")
+                metadata = {"designers": [{"name": "Local Designer"}], "license": "ofl", "axes": make_axes(families[family])}
+                return self.respond(200, (")]}'\n" + json.dumps(metadata)).encode(), "application/json")
+
+            if url.path in ["/css", "/css2"]:
+                return self.respond_css(url.path == "/css2", query)
+
+            if url.path.startswith("/s/"):
+                woff2 = url.path.endswith(".woff2")
+                return self.respond(200, make_font(url.path, config.font_size, woff2), "font/woff2" if woff2 else "font/ttf")
+
+            self.respond(404, b"Not Found", "text/plain")
+
+        def respond_css(self, css2: bool, query: Dict):
+            [family, _, styles] = query.get("family", [""])[0].partition(":")
+
+            if family not in families:
+                return self.respond(400, b"Bad Request", "text/plain")
+
+            # Browsers user agent gets woff2 fonts like the real endpoint
+            extension = "woff2" if "Chrome" in self.headers.get("User-Agent", "") else "ttf"
+            display = query.get("display", [""])[0]
+
+            if css2 and "@" in styles:
+                [axes, _, values] = styles.partition("@")
+                faces = [dict(zip(axes.split(","), value.split(","))) for value in values.split(";")]
+                faces = [(face.get("wght", "400"), face.get("ital", "0") == "1") for face in faces]
+            else:
+                faces = [(re.sub(r"\D", "", x) or "400", "i" in x) for x in (styles.split(",") if styles else ["400"])]
+
+            css = ""
+
+            for [weight, italic] in faces:
+                for subset in ["latin-ext", "latin"]:
+                    url = f"http://{self.headers['Host']}/s/{kebab_case(family)}/{weight}{'i' if italic else ''}-{subset}.{extension}"
+                    css += f"/* {subset} */\n@font-face {{\n"
+                    css += f"  font-family: '{family}';\n  font-style: {'italic' if italic else 'normal'};\n  font-weight: {weight};\n"
+                    css += f"  font-display: {display};\n" if display else ""
+                    css += f"  src: url({url}) format('{'woff2' if extension == 'woff2' else 'truetype'}');\n}}\n"
+
+            self.respond(200, css.encode(), "text/css")
+
+        def respond(self, status: int, body: bytes, content_type: str):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+
+            chunk_size = 16384
+
+            for i in range(0, len(body), chunk_size):
+                chunk = body[i:i + chunk_size]
+                self.wfile.write(chunk)
+
+                if config.bandwidth:
+                    time.sleep(len(chunk) / config.bandwidth)
+
+            with config.lock:
+                config.sent_bytes += len(body)
+
+    return Handler
+
+
+def start_server(config: Config, host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the server in a background thread, return the server and its base url"""
+
+    server = ThreadingHTTPServer((host, port), BaseHTTPRequestHandler)
+    server.daemon_threads = True
+    base_url = f"http://{host}:{server.server_address[1]}"
+    server.RequestHandlerClass = make_handler(config, load_catalog(base_url))
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, base_url
+
+
+def environment(base_url: str) -> Dict[str, str]:
+    """Environment variables to point gfont at the server"""
+
+    return {
+        "GFONT_WEBFONTS_DATA_URL": f"{base_url}/webfonts.json",
+        "GFONT_WEBFONTS_API_URL": f"{base_url}/webfonts/v1/webfonts",
+        "GFONT_METADATA_URL": f"{base_url}/metadata/fonts",
+        "GFONT_CSS_API_URL": base_url,
+        "GFONT_CONNECTIVITY_CHECK_ADDRESS": base_url.split("//")[1],
+    }
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Local stand-in for Google Fonts endpoints")
+    argparser.add_argument("--host", default="127.0.0.1")
+    argparser.add_argument("--port", type=int, default=8000)
+    argparser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    argparser.add_argument("--bandwidth", type=int, default=0, help="bytes per second per response, 0 for unlimited")
+    argparser.add_argument("--error-rate", type=float, default=0.0, help="probability to answer with 503")
+    argparser.add_argument("--font-size", type=int, default=100 * 1024, help="size of generated font files")
+    args = argparser.parse_args()
+
+    config = Config(args.latency, args.bandwidth, args.error_rate, args.font_size)
+    server, base_url = start_server(config, args.host, args.port)
+
+    for [name, value] in environment(base_url).items():
+        print(f"export {name}={value}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
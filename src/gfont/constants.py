@@ -13,6 +13,16 @@ else:
     raise Exception("You system is not supported yet")
 
 CACHE_FILE = os.path.join(CACHE_DIR, "families.json")
+INDEX_FILE = os.path.join(CACHE_DIR, "index.json")
+LOCKS_DIR = os.path.join(CACHE_DIR, "locks")
+MANIFEST_FILENAME = ".gfont-manifest.json"
+
+# Endpoints can be overridden by environment variables, e.g. to use a local mirror
+WEBFONTS_API_URL = os.getenv("GFONT_WEBFONTS_API_URL", "https://www.googleapis.com/webfonts/v1/webfonts")
+WEBFONTS_DATA_URL = os.getenv("GFONT_WEBFONTS_DATA_URL", "https://raw.githubusercontent.com/nureon22/gfont/main/data/webfonts.json")
+METADATA_URL = os.getenv("GFONT_METADATA_URL", "https://fonts.google.com/metadata/fonts")
+CSS_API_URL = os.getenv("GFONT_CSS_API_URL", "https://fonts.googleapis.com")
+CONNECTIVITY_CHECK_ADDRESS = os.getenv("GFONT_CONNECTIVITY_CHECK_ADDRESS", "8.8.8.8:53")
 
 REQUEST_TIMEOUT = 10
 MAX_WORKERS = 4
@@ -40,6 +50,12 @@ FONT_VARIANT_STANDARD_NAMES = {
     "900i": "BlackItalic",
 }
 
+# Variants downloaded before the others, so the most used fonts are usable early
+FONT_VARIANT_PRIORITY = ["400", "700", "400i", "700i"]
+
+# First four bytes of TrueType, OpenType, TrueType Collection, WOFF and WOFF2 files
+FONT_FILE_SIGNATURES = [b"\x00\x01\x00\x00", b"true", b"OTTO", b"ttcf", b"wOFF", b"wOF2"]
+
 LICENSES = {
     "apache2": ["Apache-2.0", "https://opensource.org/license/apache-2-0"],
     "ofl": ["OFL-1.1", "https://opensource.org/license/ofl-1-1"],
@@ -1,32 +1,87 @@
 import argparse
+import json
 import os
+import sys
+from datetime import date
+from typing import Iterable
 
 from . import gfontlibs as libs
-from . import utils
+from . import tracing, utils
 from .constants import VERSION
 
 IS_ASSUME_YES = False
 IS_NO_CACHE = False
 
+TSV_COLUMNS = ["family", "category", "version", "lastModified", "subsets", "variants"]
+TSV_EXTRA_COLUMNS = ["designers", "license", "axes"]
+
+
+def print_families(families: Iterable[str], format: str):
+    if format == "text":
+        for family in families:
+            print(family)
+    else:
+        for chunk in utils.format_records(libs.iter_metadata(families, False), format, TSV_COLUMNS):
+            print(chunk, end="")
+
 
 def search_command(args):
-    print("\n".join(libs.search_families(args.keywords)))
+    filters = {
+        "category": args.category,
+        "subsets": args.subset,
+        "weights": args.has_weight,
+        "variable": args.variable,
+        "modified_since": args.modified_since.isoformat() if args.modified_since else None,
+    }
+
+    if any(filters.values()):
+        print_families(libs.query_families(args.keywords, **filters), args.format)
+    elif args.keywords:
+        print_families(libs.search_families(args.keywords), args.format)
+    else:
+        utils.log("ERROR", "Enter the keywords or at least one filter")
+        sys.exit(1)
 
 
 def info_command(args):
-    print(libs.get_printable_info(libs.resolve_family(args.family, True), args.raw))
+    if args.all:
+        families = libs.get_families()
+    elif args.family:
+        families = [libs.resolve_family(family, True) for family in args.family]
+    else:
+        utils.log("ERROR", "Enter the name of the font family or use --all")
+        sys.exit(1)
+
+    if args.raw and args.format != "text":
+        utils.log("ERROR", "--raw cannot be used with --format")
+        sys.exit(1)
+
+    records = libs.iter_metadata(families, True)
+
+    if args.raw and len(families) == 1:
+        for metadata in records:
+            print(json.dumps(metadata, indent=4))
+    elif args.raw:
+        for chunk in utils.format_records(records, "json", TSV_COLUMNS + TSV_EXTRA_COLUMNS):
+            print(chunk, end="")
+    elif args.format == "text":
+        for i, metadata in enumerate(records):
+            print(("\n" if i else "") + libs.format_printable_info(metadata))
+    else:
+        for chunk in utils.format_records(records, args.format, TSV_COLUMNS + TSV_EXTRA_COLUMNS):
+            print(chunk, end="")
 
 
 def list_command(args):
     if args.all:
-        print("\n".join(libs.get_families()))
+        print_families(libs.get_families(), args.format)
     else:
         installed_families = libs.get_installed_families()
 
-        if len(installed_families) == 0:
+        if len(installed_families) == 0 and args.format == "text":
             print("No installed font families")
         else:
-            print("\n".join(installed_families))
+            print_families(installed_families, args.format)
 
 
 def download_command(args):
@@ -72,26 +127,59 @@ def update_command(args):
             libs.install_family(family, True)
 
 
+def verify_command(args):
+    if args.family:
+        families = [libs.resolve_family(family, True) for family in args.family]
+    else:
+        families = libs.get_installed_families()
+
+    broken = libs.verify_families(families)
+
+    if len(broken) == 0:
+        print(f"No broken font files in {len(families)} families")
+        return
+
+    print("Broken:")
+
+    for [family, fonts] in broken.items():
+        for font in fonts:
+            print(f"  \033[34m{family}\033[0m {font['filename']} ({font['reason']})")
+
+    if IS_ASSUME_YES or utils.ask_yes_no("Do you want to repair?"):
+        libs.repair_families(broken)
+
+
 def webfont_command(args):
     families = [family for family in args.family]
+    options = {
+        "minify": args.minify,
+        "precompress": args.precompress,
+        "preload": args.preload,
+        "preload_subset": None if args.preload_subset == "all" else args.preload_subset,
+        "inline_below": args.inline_below or 0,
+        "display": args.display,
+        "text": args.text,
+    }
 
     for family in families:
         if ":" in family:
             [family, styles] = family.split(":")
-            libs.pack_webfonts(
-                libs.resolve_family(family), not args.nowoff, args.dir, bool(args.clean), styles, display=args.display, text=args.text
-            )
+            libs.pack_webfonts(libs.resolve_family(family), not args.nowoff, args.dir, bool(args.clean), styles, **options)
         else:
-            libs.pack_webfonts(
-                libs.resolve_family(family), not args.nowoff, args.dir, bool(args.clean), display=args.display, text=args.text
-            )
+            libs.pack_webfonts(libs.resolve_family(family), not args.nowoff, args.dir, bool(args.clean), **options)
 
 
 helps = {
     "search__help": "search available font families",
     "search__keywords": "enter the keywords to search available font families",
+    "search__category": "only families of the category (e.g. 'serif', 'sans-serif', 'monospace', 'display', 'handwriting')",
+    "search__subset": "only families support the subset (e.g. 'cyrillic'), can be used multiple times",
+    "search__has_weight": "only families have the variant (e.g. '700' for any style, '700i' for italic), can be used multiple times",
+    "search__variable": "only variable font families",
+    "search__modified_since": "only families modified on or after the date (YYYY-MM-DD)",
     "info__help": "show information of the font family",
-    "info__raw": "show information in raw json format",
+    "info__raw": "show information in raw json format, as an array for multiple families",
+    "info__all": "show information of all available font families",
     "info__family": "name of the font family (case-insensitive)",
     "list__help": "list installed font families",
     "list__all": "list all available font families",
@@ -107,12 +195,22 @@ helps = {
     "remove__family": "name of the font family (case-insensitive)",
     "update__help": "update installed font families",
     "update__yes": "assume 'yes' as answer to all prompts and run non-interactively",
+    "verify__help": "verify installed font files and repair broken ones",
+    "verify__yes": "assume 'yes' as answer to all prompts and run non-interactively",
+    "verify__family": "name of the font family (case-insensitive), default to all installed families",
+    "format": "output format, json, jsonl and tsv are written as they are generated",
+    "limit_rate": "limit total download bandwidth in bytes per second, K, M and G suffixes are allowed (e.g. '500K')",
     "webfont__help": "pack a font family to use in websites",
     "webfont__dir": "directory to place the packed webfonts",
     "webfont__nowoff": "Use OTF or TTF fonts instead of woff fonts",
     "webfont__clean": "clean previous generated font files",
     "webfont__display": "font-display property of the font family",
     "webfont__text": "Reduce bandwidth by specific text",
+    "webfont__minify": "minify the CSS file",
+    "webfont__precompress": "write .gz and .br (needs 'brotli' package) files next to the CSS file and ttf or otf fonts",
+    "webfont__preload": "variant of critical font faces to create <link rel=\"preload\"> snippets in the manifest (e.g. '400', '700i'), can be used multiple times",
+    "webfont__preload_subset": "only preload font faces of this subset, 'all' for every subset, default to latin",
+    "webfont__inline_below": "inline fonts smaller than this size into the CSS file as data URIs, K and M suffixes are allowed (e.g. '4K')",
     "webfont__no_cache": "download the font again, even it is already downloaded",
     "webfont__family": "name of the font family (case-insensitive) plus fonts specs (optional). Support both google fonts api v1 and v2. (e.g. 'open-sans:400,700', 'open-sans:ital,wght@0,700;1,700', 'open-sans:ital,wght@0,300..700')",
 }
@@ -121,33 +219,49 @@ helps = {
 def main():
     argparser = argparse.ArgumentParser(prog="gfont", description="Browse and download fonts from fonts.google.com")
     argparser.add_argument("-v", "--version", action="store_true", help="show version and exit")
+    argparser.add_argument("--timings", action="store_true", help="show a summary of time spent in each step to stderr")
+    argparser.add_argument("--trace", metavar="PATH", help="write timing events as newline-delimited json into PATH, '-' for stderr")
 
     subparsers = argparser.add_subparsers(title="commands")
 
+    # options shared by sub-commands which print families
+    format_options = argparse.ArgumentParser(add_help=False)
+    format_options.add_argument("--format", choices=["text", "json", "jsonl", "tsv"], default="text", help=helps["format"])
+
+    # options shared by sub-commands which download fonts
+    download_options = argparse.ArgumentParser(add_help=False)
+    download_options.add_argument("--limit-rate", type=utils.parse_size, help=helps["limit_rate"])
+
     # search sub-command
-    search_parser = subparsers.add_parser("search", help=helps["search__help"])
-    search_parser.add_argument("keywords", nargs="+", help=helps["search__keywords"])
+    search_parser = subparsers.add_parser("search", help=helps["search__help"], parents=[format_options])
+    search_parser.add_argument("--category", help=helps["search__category"])
+    search_parser.add_argument("--subset", action="append", help=helps["search__subset"])
+    search_parser.add_argument("--has-weight", action="append", help=helps["search__has_weight"])
+    search_parser.add_argument("--variable", action="store_true", help=helps["search__variable"])
+    search_parser.add_argument("--modified-since", type=date.fromisoformat, help=helps["search__modified_since"])
+    search_parser.add_argument("keywords", nargs="*", help=helps["search__keywords"])
     search_parser.set_defaults(func=search_command)
 
     # info sub-command
-    info_parser = subparsers.add_parser("info", help=helps["info__help"])
+    info_parser = subparsers.add_parser("info", help=helps["info__help"], parents=[format_options])
     info_parser.add_argument("--raw", action="store_true", help=helps["info__raw"])
-    info_parser.add_argument("family", help=helps["info__family"])
+    info_parser.add_argument("--all", action="store_true", help=helps["info__all"])
+    info_parser.add_argument("family", nargs="*", help=helps["info__family"])
     info_parser.set_defaults(func=info_command)
 
     # list sub-command
-    list_parser = subparsers.add_parser("list", help=helps["list__help"])
+    list_parser = subparsers.add_parser("list", help=helps["list__help"], parents=[format_options])
     list_parser.add_argument("--all", action="store_true", help=helps["list__all"])
     list_parser.set_defaults(func=list_command)
 
     # download sub-command
-    download_parser = subparsers.add_parser("download", help=helps["download__help"])
+    download_parser = subparsers.add_parser("download", help=helps["download__help"], parents=[download_options])
     download_parser.add_argument("--dir", required=False, default=".", help=helps["download__dir"])
     download_parser.add_argument("family", nargs="+", help=helps["download__family"])
     download_parser.set_defaults(func=download_command)
 
     # install sub-command
-    install_parser = subparsers.add_parser("install", help=helps["install__help"])
+    install_parser = subparsers.add_parser("install", help=helps["install__help"], parents=[download_options])
     install_parser.add_argument("-y", "--yes", action="store_true", help=helps["install__yes"])
     install_parser.add_argument("--no-cache", action="store_true", help=helps["install__no_cache"])
     install_parser.add_argument("family", nargs="+", help=helps["install__family"])
@@ -160,18 +274,29 @@ def main():
     remove_parser.set_defaults(func=remove_command)
 
     # update sub-command
-    update_parser = subparsers.add_parser("update", help=helps["update__help"])
+    update_parser = subparsers.add_parser("update", help=helps["update__help"], parents=[download_options])
     update_parser.add_argument("-y", "--yes", action="store_true", help=helps["update__yes"])
     update_parser.set_defaults(func=update_command)
 
+    # verify sub-command
+    verify_parser = subparsers.add_parser("verify", help=helps["verify__help"], parents=[download_options])
+    verify_parser.add_argument("-y", "--yes", action="store_true", help=helps["verify__yes"])
+    verify_parser.add_argument("family", nargs="*", help=helps["verify__family"])
+    verify_parser.set_defaults(func=verify_command)
+
     # webfont sub-command
-    webfont_parser = subparsers.add_parser("webfont", help=helps["webfont__help"])
+    webfont_parser = subparsers.add_parser("webfont", help=helps["webfont__help"], parents=[download_options])
     webfont_parser.add_argument("--dir", required=True, help=helps["webfont__dir"])
     webfont_parser.add_argument("--nowoff", action="store_true", help=helps["webfont__nowoff"])
     webfont_parser.add_argument("--clean", action="store_true", help=helps["webfont__clean"])
     webfont_parser.add_argument("--no-cache", action="store_true", help=helps["webfont__no_cache"])
     webfont_parser.add_argument("--display", help=helps["webfont__display"])
     webfont_parser.add_argument("--text", help=helps["webfont__text"])
+    webfont_parser.add_argument("--minify", action="store_true", help=helps["webfont__minify"])
+    webfont_parser.add_argument("--precompress", action="store_true", help=helps["webfont__precompress"])
+    webfont_parser.add_argument("--preload", action="append", help=helps["webfont__preload"])
+    webfont_parser.add_argument("--preload-subset", default="latin", help=helps["webfont__preload_subset"])
+    webfont_parser.add_argument("--inline-below", type=utils.parse_size, help=helps["webfont__inline_below"])
     webfont_parser.add_argument("family", nargs="+", help=helps["webfont__family"])
     webfont_parser.set_defaults(func=webfont_command)
 
@@ -189,8 +314,32 @@ def main():
     if "no_cache" in args and args.no_cache:
         IS_NO_CACHE = True
 
-    if "func" in args:
-        args.func(args)
+    if "limit_rate" in args and args.limit_rate:
+        utils.set_rate_limit(args.limit_rate)
+
+    trace_file = None
+
+    if args.trace == "-":
+        tracing.enable(sys.stderr)
+    elif args.trace:
+        trace_file = open(args.trace, "a", buffering=1)
+        tracing.enable(trace_file)
+    elif args.timings:
+        tracing.enable()
+
+    try:
+        if "func" in args:
+            with tracing.span("command", command=args.func.__name__.replace("_command", "")):
+                args.func(args)
+    except BrokenPipeError:
+        # Output is piped into a command which exited early (e.g. head)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if args.timings:
+            tracing.print_summary()
+        if trace_file:
+            trace_file.close()
 
 
 if __name__ == "__main__":
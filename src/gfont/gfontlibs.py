@@ -1,27 +1,35 @@
+import bisect
 import json
 import os
 import re
 import shutil
 import subprocess
 import sys
-import time
 import urllib.parse
-from datetime import datetime
-from typing import Dict, List, Optional
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Set
 
-from requests import request
+from requests import RequestException
 
-from . import utils
+from . import tracing, utils
 from .constants import (
     BROWSER_USER_AGENT,
     CACHE_FILE,
+    CSS_API_URL,
     FONTS_DIR,
+    INDEX_FILE,
     LICENSES,
-    REQUEST_TIMEOUT,
+    LOCKS_DIR,
+    MANIFEST_FILENAME,
+    METADATA_URL,
+    WEBFONTS_API_URL,
+    WEBFONTS_DATA_URL,
 )
 
 __families: Dict[str, Dict] = {}
 __families_list: List[str] = []
+__families_mtime: Optional[float] = None
+__index: Optional[Dict] = None
 
 
 def get_families(refresh: bool = False) -> List[str]:
@@ -29,49 +37,188 @@ def get_families(refresh: bool = False) -> List[str]:
 
     global __families
     global __families_list
+    global __families_mtime
 
     if refresh:
         __families = {}
         __families_list = []
+        __families_mtime = None
     elif not os.path.isfile(CACHE_FILE):
         refresh = True
 
     if __families_list:
         return __families_list
 
-    API_KEY = os.getenv("GOOGLE_FONTS_API_KEY")
+    with tracing.span("get_families", cache="miss" if refresh else "hit"):
+        API_KEY = os.getenv("GOOGLE_FONTS_API_KEY")
 
-    if API_KEY:
-        url = "https://www.googleapis.com/webfonts/v1/webfonts?key=" + API_KEY
-    else:
-        url = "https://raw.githubusercontent.com/nureon22/gfont/main/data/webfonts.json"
+        if API_KEY:
+            url = f"{WEBFONTS_API_URL}?key={API_KEY}"
+        else:
+            url = WEBFONTS_DATA_URL
 
-    if refresh:
-        print("Refreshing families metadata", end="\033[K\r")
+        if refresh:
+            print("Refreshing families metadata", end="\033[K\r")
 
-        utils.need_internet_connection()
-        res = request("GET", url, timeout=REQUEST_TIMEOUT)
-        res.raise_for_status()
+            utils.need_internet_connection()
+            res = utils.http_get(url)
 
-        for item in res.json()["items"]:
-            item["variants"] = utils.resolve_variants(item["variants"], True)
-            __families[utils.snake_case(item["family"])] = item
+            families_axes = get_families_axes()
 
-        utils.write_file(CACHE_FILE, json.dumps(__families, indent=4))
+            for item in res.json()["items"]:
+                item["variants"] = utils.resolve_variants(item["variants"], True)
+                item["axes"] = families_axes.get(item["family"], [])
+                __families[utils.snake_case(item["family"])] = item
 
-        # Clear previous line
-        print("", end="\033[K\r")
-    else:
-        __families = json.loads(utils.read_file(CACHE_FILE))  # type: ignore
+            save_families()
+
+            # Clear previous line
+            print("", end="\033[K\r")
+        else:
+            try:
+                __families_mtime = os.path.getmtime(CACHE_FILE)
+                __families = json.loads(utils.read_file(CACHE_FILE))  # type: ignore
+            except ValueError:
+                utils.log("WARNING", "Families metadata cache is corrupted")
+                return get_families(True)
 
-    __families_list = [__families[x]["family"] for x in __families]
-    __families_list.sort()
+        __families_list = [__families[x]["family"] for x in __families]
+        __families_list.sort()
 
     return __families_list
 
 
-def get_metadata(family: str, need_extra: bool):
-    """Get metadata of the family"""
+def get_families_axes() -> Dict[str, List[Dict]]:
+    """Get variable font axes of all families from the catalog metadata.
+
+    Neither the webfonts API nor data/webfonts.json contain axes, the catalog metadata does in a single request.
+    Return an empty dictionary if it cannot be fetched, axes are fetched later per family with extra metadata.
+    """
+
+    try:
+        res = utils.http_get(METADATA_URL)
+        data = json.loads(res.text.replace(")]}'", "", 1))
+        return {x["family"]: x.get("axes", []) for x in data["familyMetadataList"]}
+    except (RequestException, ValueError, KeyError) as error:
+        utils.log("WARNING", f"Axes of variable fonts cannot be fetched ({error})", file=sys.stderr)
+        return {}
+
+
+def save_families():
+    """Write families metadata into cache file, merged with what other processes have written meanwhile.
+
+    If another process wrote the cache file since it was loaded (e.g. refreshed it), its catalog is kept and only
+    extra metadata fetched by this process are added into it. Otherwise extra metadata written by other processes
+    are added into the catalog of this process. Facet indexes are rebuilt from the written metadata.
+    """
+
+    global __families
+    global __families_list
+    global __families_mtime
+    global __index
+
+    with utils.file_lock(os.path.join(LOCKS_DIR, os.path.basename(CACHE_FILE) + ".lock")):
+        try:
+            cached_families = json.loads(utils.read_file(CACHE_FILE) or "{}")
+        except ValueError:
+            cached_families = {}
+
+        if cached_families and __families_mtime is not None and os.path.getmtime(CACHE_FILE) != __families_mtime:
+            [families, others] = [cached_families, __families]
+        else:
+            [families, others] = [__families, cached_families]
+
+        for [key, metadata] in families.items():
+            other = others.get(key, {})
+
+            if has_extra_metadata(other) and not has_extra_metadata(metadata) and other["lastModified"] == metadata["lastModified"]:
+                for extra in ["designers", "license", "axes"]:
+                    metadata[extra] = other[extra]
+
+        if families is not __families:
+            __families = families
+            __families_list = sorted(x["family"] for x in families.values())
+
+        utils.write_file(CACHE_FILE, json.dumps(__families, indent=4))
+        __families_mtime = os.path.getmtime(CACHE_FILE)
+        utils.write_file(INDEX_FILE, json.dumps(build_index(__families, __families_mtime)))
+
+    __index = None
+
+
+def build_index(families: Dict[str, Dict], source_mtime: Optional[float]) -> Dict:
+    """Build per-facet indexes of families metadata for query_families
+
+    :param source_mtime: mtime of the cache file {families} were loaded from or written into
+    """
+
+    index: Dict = {"source_mtime": source_mtime, "category": {}, "subset": {}, "variant": {}, "variable": [], "lastModified": []}
+
+    for metadata in families.values():
+        family = metadata["family"]
+
+        index["category"].setdefault(metadata["category"], []).append(family)
+        index["lastModified"].append([metadata["lastModified"], family])
+
+        for subset in metadata["subsets"]:
+            index["subset"].setdefault(subset, []).append(family)
+
+        for variant in metadata["variants"]:
+            index["variant"].setdefault(variant, []).append(family)
+
+        if metadata.get("axes"):
+            index["variable"].append(family)
+
+    index["lastModified"].sort()
+
+    return index
+
+
+def get_index() -> Dict:
+    """Get per-facet indexes of families metadata, loaded from cache or built if the cache is stale.
+
+    An index built from the current cache file is loaded without loading families metadata.
+    """
+
+    global __index
+
+    if __index is not None:
+        return __index
+
+    try:
+        index = json.loads(utils.read_file(INDEX_FILE) or "null")
+    except ValueError:
+        index = None
+
+    if index is None or not os.path.isfile(CACHE_FILE) or index["source_mtime"] != os.path.getmtime(CACHE_FILE):
+        get_families()
+        index = build_index(__families, __families_mtime)
+        utils.write_file(INDEX_FILE, json.dumps(index))
+
+    __index = {
+        "category": {x: set(y) for [x, y] in index["category"].items()},
+        "subset": {x: set(y) for [x, y] in index["subset"].items()},
+        "variant": {x: set(y) for [x, y] in index["variant"].items()},
+        "variable": set(index["variable"]),
+        "lastModified": ([x[0] for x in index["lastModified"]], [x[1] for x in index["lastModified"]]),
+    }
+
+    return __index
+
+
+def lock_family(family: str):
+    """Lock the install directory of a family against other gfont processes, used as context manager"""
+
+    utils.isinstance_check(family, str, "First argument 'family' must be 'str'")
+
+    return utils.file_lock(os.path.join(LOCKS_DIR, family.replace(" ", "_") + ".lock"))
+
+
+def get_metadata(family: str, need_extra: bool, save: bool = True):
+    """Get metadata of the family
+
+    :param save: if False, fetched extra metadata isn't written into cache file, caller must call save_families
+    """
 
     family = resolve_family(family)
     family_snake = utils.snake_case(family)
@@ -84,37 +231,77 @@ def get_metadata(family: str, need_extra: bool):
     if not need_extra:
         return metadata
 
-    if "designers" not in metadata or "license" not in metadata or "axes" not in metadata:
-        if family.startswith("Material Icons"):
-            metadata["designers"] = ["Google"]
-            metadata["license"] = "apache2"
-            metadata["axes"] = []
-
-        elif family.startswith("Material Symbols"):
-            metadata["designers"] = ["Google"]
-            metadata["license"] = "apache2"
-            metadata["axes"] = [
-                {"tag": "opsz", "min": 20, "max": 48},
-                {"tag": "wght", "min": 100, "max": 700},
-                {"tag": "FILL", "min": 0, "max": 1},
-                {"tag": "GRAD", "min": -50, "max": 200},
-            ]
+    with tracing.span("get_metadata", family=family, cache="hit") as span:
+        if not has_extra_metadata(metadata):
+            span["cache"] = "miss"
+
+            if family.startswith("Material Icons"):
+                metadata["designers"] = ["Google"]
+                metadata["license"] = "apache2"
+                metadata["axes"] = []
+
+            elif family.startswith("Material Symbols"):
+                metadata["designers"] = ["Google"]
+                metadata["license"] = "apache2"
+                metadata["axes"] = [
+                    {"tag": "opsz", "min": 20, "max": 48},
+                    {"tag": "wght", "min": 100, "max": 700},
+                    {"tag": "FILL", "min": 0, "max": 1},
+                    {"tag": "GRAD", "min": -50, "max": 200},
+                ]
 
-        else:
-            utils.need_internet_connection()
-            url = f"https://fonts.google.com/metadata/fonts/{family}"
-            res = request("GET", url, timeout=REQUEST_TIMEOUT)
-            res.raise_for_status()
-            data = json.loads(res.text.replace(")]}'", "", 1))
-            metadata["designers"] = [x["name"] for x in data["designers"]]
-            metadata["license"] = data["license"]
-            metadata["axes"] = data["axes"]
+            else:
+                utils.need_internet_connection()
+                url = f"{METADATA_URL}/{family}"
+                res = utils.http_get(url)
+                data = json.loads(res.text.replace(")]}'", "", 1))
+                metadata["designers"] = [x["name"] for x in data["designers"]]
+                metadata["license"] = data["license"]
+                metadata["axes"] = data["axes"]
 
-        utils.write_file(CACHE_FILE, json.dumps(__families, indent=4))
+            if save:
+                save_families()
 
     return metadata
 
 
+def has_extra_metadata(metadata: Dict) -> bool:
+    return "designers" in metadata and "license" in metadata and "axes" in metadata
+
+
+def iter_metadata(families: Iterable[str], need_extra: bool) -> Iterator[Dict]:
+    """Yield metadata of families in the given order.
+
+    Extra metadata are fetched concurrently a few families ahead, and written into cache file once at the end.
+    Families whose extra metadata cannot be fetched are skipped with a warning.
+    """
+
+    if not need_extra:
+        for family in families:
+            yield get_metadata(family, False)
+        return
+
+    fetched = []
+
+    def _get_metadata(family):
+        if not has_extra_metadata(get_metadata(family, False)):
+            fetched.append(family)
+
+        try:
+            return get_metadata(family, True, False)
+        except (RequestException, ValueError, KeyError) as error:
+            utils.log("WARNING", f"Metadata of '{family}' cannot be fetched ({error})", file=sys.stderr)
+            return None
+
+    try:
+        for metadata in utils.thread_pool_imap(_get_metadata, families):
+            if metadata is not None:
+                yield metadata
+    finally:
+        if fetched:
+            save_families()
+
+
 def get_webfonts_css(family: str, woff2: bool, styles: str = "", **parameters: Optional[str]) -> str:
     """Return CSS content of a font family"""
 
@@ -124,7 +311,7 @@ def get_webfonts_css(family: str, woff2: bool, styles: str = "", **parameters: O
 
     api_version = "css2" if "@" in styles else "css"
 
-    url = f"https://fonts.googleapis.com/{api_version}?family=" + family.replace(" ", "+")
+    url = f"{CSS_API_URL}/{api_version}?family=" + family.replace(" ", "+")
 
     if styles:
         url = url + ":" + styles
@@ -139,8 +326,9 @@ def get_webfonts_css(family: str, woff2: bool, styles: str = "", **parameters: O
 
     # User-Agent is specified to make sure woff2 fonts are returned instead of ttf fonts
     headers = {"User-Agent": BROWSER_USER_AGENT} if woff2 else {}
-    res = request("GET", url, headers=headers, timeout=REQUEST_TIMEOUT)
-    res.raise_for_status()
+
+    with tracing.span("get_webfonts_css", family=family):
+        res = utils.http_get(url, headers)
 
     return f"/* original-url: {url} */\n\n{res.text}"
 
@@ -171,28 +359,45 @@ def get_printable_info(family: str, isRaw: bool = False) -> str:
 
     metadata = get_metadata(family, True)
 
-    content = ""
-
     if isRaw:
-        content = json.dumps(metadata, indent=4)
-    else:
-        axes = [f"@{x['tag']}={x['min']}>{x['max']}" for x in metadata["axes"]]
+        return json.dumps(metadata, indent=4)
+
+    return format_printable_info(metadata)
+
 
-        max_length = os.get_terminal_size().columns
-        line_breaker = "\n" + " " * 12
+def format_printable_info(metadata: Dict, color: Optional[bool] = None) -> str:
+    """Format metadata with extra metadata in pretty print format
 
-        content = ""
-        content += f"\033[01;34m{metadata['family']}\033[0m\n"
-        content += "------------\n"
-        content += f"\033[34mVersion\033[0m   : {metadata['version']}\n"
-        content += f"\033[34mCategory\033[0m  : {metadata['category']}\n"
-        content += utils.split_long_text(f"\033[34mSubsets\033[0m   : {', '.join(metadata['subsets'])}\n", max_length, ", ", line_breaker)
-        content += utils.split_long_text(f"\033[34mVariants\033[0m  : {', '.join(metadata['variants'])}\n", max_length, ", ", line_breaker)
-        content += utils.split_long_text(f"\033[34mAxes\033[0m      : {', '.join(axes) if axes else 'None'}\n", max_length, ", ", line_breaker)
-        content += utils.split_long_text(f"\033[34mDesigners\033[0m : {', '.join(metadata['designers'])}\n", max_length, ", ", line_breaker)
-        content += utils.split_long_text(f"\033[34mLicense\033[0m   : {LICENSES[metadata['license']][0]}", max_length, ", ", line_breaker)
+    :param color: use ANSI colors, default to whether stdout is a terminal
+    """
+
+    utils.isinstance_check(metadata, Dict, "First argument 'metadata' must be 'Dict'")
+
+    if color is None:
+        color = sys.stdout.isatty()
+
+    def _paint(text: str, code: str):
+        return f"\033[{code}m{text}\033[0m" if color else text
+
+    axes = [f"@{x['tag']}={x['min']}>{x['max']}" for x in metadata["axes"]]
+
+    # Fallback to 80 columns if stdout isn't a terminal
+    max_length = shutil.get_terminal_size().columns
+    line_breaker = "\n" + " " * 12
+
+    lines = [
+        _paint(metadata["family"], "01;34"),
+        "------------",
+        f"{_paint('Version', '34')}   : {metadata['version']}",
+        f"{_paint('Category', '34')}  : {metadata['category']}",
+        utils.split_long_text(f"{_paint('Subsets', '34')}   : {', '.join(metadata['subsets'])}", max_length, ", ", line_breaker),
+        utils.split_long_text(f"{_paint('Variants', '34')}  : {', '.join(metadata['variants'])}", max_length, ", ", line_breaker),
+        utils.split_long_text(f"{_paint('Axes', '34')}      : {', '.join(axes) if axes else 'None'}", max_length, ", ", line_breaker),
+        utils.split_long_text(f"{_paint('Designers', '34')} : {', '.join(metadata['designers'])}", max_length, ", ", line_breaker),
+        utils.split_long_text(f"{_paint('License', '34')}   : {LICENSES[metadata['license']][0]}", max_length, ", ", line_breaker),
+    ]
 
-    return content
+    return "\n".join(lines)
 
 
 def search_families(keywords: List[str], exact: bool = False) -> List[str]:
@@ -207,26 +412,75 @@ def search_families(keywords: List[str], exact: bool = False) -> List[str]:
     utils.isinstance_check(keywords, List, "First argument 'keywords' must be 'List'")
     utils.isinstance_check(exact, bool, "Second argument 'exact' must be 'bool'")
 
-    results = []
+    return [family for family in get_families() if match_keywords(family, keywords, exact)]
 
-    for family in get_families():
-        not_found = False
-        family_lower = family.lower()
 
-        for keyword in keywords:
-            utils.isinstance_check(keyword, str, "First argument 'keywords' must be 'List[str]'")
+def match_keywords(family: str, keywords: List[str], exact: bool = False) -> bool:
+    """Check the family name contains all given keywords (case-insensitive)"""
 
-            keyword = keyword.replace("  ", "").strip().lower()
+    family_lower = family.lower()
 
-            if exact:
-                if family_lower != keyword:
-                    not_found = True
-            else:
-                if family_lower.find(keyword) == -1:
-                    not_found = True
+    for keyword in keywords:
+        utils.isinstance_check(keyword, str, "First argument 'keywords' must be 'List[str]'")
+
+        keyword = keyword.replace("  ", "").strip().lower()
+
+        if exact:
+            if family_lower != keyword:
+                return False
+        else:
+            if family_lower.find(keyword) == -1:
+                return False
+
+    return True
+
+
+def query_families(
+    keywords: Optional[List[str]] = None,
+    category: Optional[str] = None,
+    subsets: Optional[List[str]] = None,
+    weights: Optional[List[str]] = None,
+    variable: bool = False,
+    modified_since: Optional[str] = None,
+) -> List[str]:
+    """Search font families matching all given facets, using indexes from get_index.
+
+    :param weights: variants such as '700' (upright or italic) or '700i' (italic only)
+    :param variable: only families known to have variable axes
+    :param modified_since: ISO date, only families modified on or after it
+    :return - Return a list contains font family names
+    """
+
+    index = get_index()
+    candidates: Optional[Set[str]] = None
+
+    def _narrow(families: Set[str]):
+        nonlocal candidates
+        candidates = families if candidates is None else candidates & families
+
+    if category:
+        _narrow(index["category"].get(category.lower(), set()))
+
+    for subset in subsets or []:
+        _narrow(index["subset"].get(subset.lower(), set()))
+
+    for weight in utils.resolve_variants(weights or [], True):
+        if weight.endswith("i"):
+            _narrow(index["variant"].get(weight, set()))
+        else:
+            _narrow(index["variant"].get(weight, set()) | index["variant"].get(weight + "i", set()))
+
+    if variable:
+        _narrow(index["variable"])
+
+    if modified_since:
+        [dates, families] = index["lastModified"]
+        _narrow(set(families[bisect.bisect_left(dates, modified_since):]))
+
+    results = get_families() if candidates is None else sorted(candidates)
 
-        if not not_found:
-            results.append(family)
+    if keywords:
+        results = [family for family in results if match_keywords(family, keywords)]
 
     return results
 
@@ -237,46 +491,49 @@ def resolve_family(family: str, exact: bool = False) -> str:
     utils.isinstance_check(family, str, "First argument 'family' must be 'str'")
     utils.isinstance_check(exact, bool, "Second argument 'exact' must be 'bool'")
 
-    _family = family
-    family = re.sub(r"[-_\+]", " ", family)
-    families = get_families()
+    with tracing.span("resolve_family", family=family):
+        _family = family
+        family = re.sub(r"[-_\+]", " ", family)
+        families = get_families()
 
-    if family in families:
-        return family
+        if family in families:
+            return family
 
-    for x in families:
-        if x.lower() == family:
-            return x
+        for x in families:
+            if x.lower() == family:
+                return x
 
-    utils.log("Error", f"Family '{_family}' cannot be found")
-    sys.exit(1)
+        utils.log("Error", f"Family '{_family}' cannot be found")
+        sys.exit(1)
 
 
 def download_fonts(family: str, fonts: List[Dict], dir: str, nocache: bool = False):
     """Download the given font, not complete set of font family.
 
     :param fonts: List of dictionary that hold information of a font, should contains 'filename' and 'url' properties.
+        Fonts with optional 'variant' property are downloaded in order of utils.variant_priority.
     """
 
     utils.isinstance_check(family, str, "First argument 'family' must be 'str'")
     utils.isinstance_check(fonts, List, "Second argument 'fonts' must be 'List'")
     utils.isinstance_check(dir, str, "Third argument 'dir' must be 'str'")
 
-    total = len(fonts)
-    total_width = len(str(total))
+    fonts = sorted(fonts, key=lambda font: utils.variant_priority(font.get("variant")))
+    progress = utils.DownloadProgress(f"Downloading '\033[01m{family}\033[00m'", len(fonts))
 
     def _download(font):
         filepath = os.path.join(dir, font["filename"])
-        current = str(fonts.index(font) + 1).rjust(total_width, "0")
 
-        print(f"Downloading '\033[01m{family}\033[00m' ({current}/{total})", end="\033[K\r")
-
-        if os.path.isfile(filepath) and not nocache:
-            return
+        with tracing.span("download", family=family, filename=font["filename"]) as span:
+            if os.path.isfile(filepath) and not nocache:
+                span["cache"] = "hit"
+            else:
+                span["cache"] = "miss"
+                content = utils.http_download(font["url"], progress)
+                span["bytes"] = len(content)
+                utils.write_bytes_file(filepath, content)
 
-        res = request("GET", font["url"], timeout=REQUEST_TIMEOUT)
-        res.raise_for_status()
-        utils.write_bytes_file(filepath, res.content)
+        progress.finish_file()
 
     utils.need_internet_connection()
     utils.thread_pool_loop(_download, fonts)
@@ -294,7 +551,8 @@ def get_font_files(family: str) -> List[Dict[str, str]]:
         fonts.append(
             {
                 "filename": f'{family.replace(" ", "_")}-{utils.resolve_variant(variant, False)}{os.path.splitext(url)[1]}',
-                "url": url
+                "url": url,
+                "variant": utils.resolve_variant(variant, True),
             }
         )
 
@@ -310,23 +568,172 @@ def install_family(family: str, nocache: bool = False):
     metadata = get_metadata(family, False)
 
     subdir = os.path.join(FONTS_DIR, family.replace(" ", "_"))
-    fonts = []
+    fonts = get_font_files(family)
 
-    for [variant, url] in metadata["files"].items():
-        filename = family.replace(" ", "_")
-        filename = filename + "-" + utils.resolve_variant(variant, False)  # Convert to standard font variant
-        filename = filename + os.path.splitext(url)[1]  # Add file extension
-        fonts.append({"filename": filename, "url": url})
+    with lock_family(family):
+        if nocache or is_family_outdated(family):
+            download_fonts(family, fonts, subdir, True)
+            write_manifest(family, fonts, subdir, metadata["lastModified"])
+        else:
+            # Files already on disk are kept only if they pass verification, so broken files are downloaded again
+            # instead of being recorded with their broken checksum
+            broken = {x["filename"] for x in verify_families([family]).get(family, [])}
+            manifest = read_manifest(subdir) or {"files": {}}
+            kept = {x: y for [x, y] in manifest["files"].items() if x not in broken}
 
-    lastModified = datetime.fromisoformat(metadata["lastModified"])
-    download_fonts(family, fonts, subdir, nocache or lastModified.timestamp() > time.time())
+            download_fonts(family, [x for x in fonts if x["filename"] in broken or not os.path.isfile(os.path.join(subdir, x["filename"]))], subdir, True)
+            write_manifest(family, fonts, subdir, metadata["lastModified"], kept)
 
-    if shutil.which("fc-cache"):
-        subprocess.call("fc-cache")
+    update_font_cache()
 
     print(f"Installation '{family}' finished.")
 
 
+def is_family_outdated(family: str) -> bool:
+    """Check installed files of the family are from a different version than metadata.
+
+    The version of files installed without manifest (e.g. by older gfont) is unknown, they are only outdated if
+    they were downloaded before the version was released.
+    """
+
+    utils.isinstance_check(family, str, "First argument 'family' must be 'str'")
+
+    family = resolve_family(family)
+    dir = os.path.join(FONTS_DIR, family.replace(" ", "_"))
+    manifest = read_manifest(dir)
+    lastModified = get_metadata(family, False)["lastModified"]
+
+    if manifest is not None and manifest["lastModified"] is not None:
+        return manifest["lastModified"] != lastModified
+
+    if not os.path.isdir(dir):
+        return False
+
+    mtimes = [os.path.getmtime(os.path.join(dir, x)) for x in os.listdir(dir) if x != MANIFEST_FILENAME]
+
+    return bool(mtimes) and date.fromtimestamp(min(mtimes)).isoformat() < lastModified
+
+
+def read_manifest(dir: str) -> Optional[Dict]:
+    """Read install manifest of a font family directory. Return None if it is missing or unreadable."""
+
+    utils.isinstance_check(dir, str, "First argument 'dir' must be 'str'")
+
+    content = utils.read_file(os.path.join(dir, MANIFEST_FILENAME))
+
+    if content is None:
+        return None
+
+    try:
+        return json.loads(content)
+    except ValueError:
+        return None
+
+
+def write_manifest(family: str, fonts: List[Dict], dir: str, lastModified: Optional[str], kept: Optional[Dict] = None):
+    """Record size and sha256 of downloaded font files, used by verify_families to detect broken files.
+
+    :param lastModified: lastModified of the installed version, None if it is unknown
+    :param kept: entries of a previous manifest for files that weren't downloaded again, they aren't hashed again
+    """
+
+    utils.isinstance_check(family, str, "First argument 'family' must be 'str'")
+    utils.isinstance_check(fonts, List, "Second argument 'fonts' must be 'List'")
+    utils.isinstance_check(dir, str, "Third argument 'dir' must be 'str'")
+
+    kept = kept or {}
+
+    def _describe(font):
+        if font["filename"] in kept:
+            return font["filename"], {**kept[font["filename"]], "url": font["url"]}
+
+        filepath = os.path.join(dir, font["filename"])
+        return font["filename"], {"url": font["url"], "size": os.path.getsize(filepath), "sha256": utils.file_sha256(filepath)}
+
+    manifest = {
+        "family": family,
+        "lastModified": lastModified,
+        "files": dict(sorted(utils.thread_pool_loop(_describe, fonts))),
+    }
+
+    utils.write_file(os.path.join(dir, MANIFEST_FILENAME), json.dumps(manifest, indent=4))
+
+
+def verify_families(families: List[str]) -> Dict[str, List[Dict]]:
+    """Check installed font files of given families in parallel.
+
+    Files are compared against size and sha256 recorded in install manifest and their font headers are checked.
+    Families installed without manifest only get the header check.
+
+    :return: Dictionary of family and its broken fonts, each font contains 'filename', 'url' and 'reason' properties.
+    """
+
+    utils.isinstance_check(families, List, "First argument 'families' must be 'List'")
+
+    items = []
+
+    for family in families:
+        family = resolve_family(family)
+        manifest = read_manifest(os.path.join(FONTS_DIR, family.replace(" ", "_")))
+
+        if manifest is None:
+            items.extend([(family, font, None) for font in get_font_files(family)])
+        else:
+            items.extend([(family, {"filename": x, "url": y["url"]}, y) for [x, y] in manifest["files"].items()])
+
+    def _verify(item):
+        [family, font, expected] = item
+        filepath = os.path.join(FONTS_DIR, family.replace(" ", "_"), font["filename"])
+
+        if not os.path.isfile(filepath):
+            reason = "missing"
+        elif expected and os.path.getsize(filepath) != expected["size"]:
+            reason = "size mismatch"
+        elif not utils.check_font_file(filepath):
+            reason = "invalid font header"
+        elif expected and utils.file_sha256(filepath) != expected["sha256"]:
+            reason = "checksum mismatch"
+        else:
+            return None
+
+        return family, {**font, "reason": reason}
+
+    broken: Dict[str, List[Dict]] = {}
+
+    for result in utils.thread_pool_loop(_verify, items):
+        if result:
+            broken.setdefault(result[0], []).append(result[1])
+
+    return broken
+
+
+def repair_families(broken: Dict[str, List[Dict]]):
+    """Download again only the broken fonts returned by verify_families"""
+
+    utils.isinstance_check(broken, Dict, "First argument 'broken' must be 'Dict'")
+
+    for [family, fonts] in broken.items():
+        subdir = os.path.join(FONTS_DIR, family.replace(" ", "_"))
+
+        with lock_family(family):
+            manifest = read_manifest(subdir)
+
+            download_fonts(family, fonts, subdir, True)
+
+            if manifest is None:
+                write_manifest(family, get_font_files(family), subdir, None)
+            else:
+                repaired = {x["filename"] for x in fonts}
+                kept = {x: y for [x, y] in manifest["files"].items() if x not in repaired}
+                fonts = [{"filename": x, "url": y["url"]} for [x, y] in manifest["files"].items()]
+                write_manifest(family, fonts, subdir, manifest["lastModified"], kept)
+
+        print(f"Repairing '{family}' finished.")
+
+    if broken:
+        update_font_cache()
+
+
 def remove_family(family: str):
     """Remove already installed font family. If given font family wasn't installed yet, do nothing."""
 
@@ -335,13 +742,23 @@ def remove_family(family: str):
     family = resolve_family(family)
     dir = os.path.join(FONTS_DIR, family.replace(" ", "_"))
 
-    if os.path.isdir(dir):
+    with lock_family(family):
+        if not os.path.isdir(dir):
+            return
+
         shutil.rmtree(dir)
 
-        if shutil.which("fc-cache"):
-            subprocess.call("fc-cache")
+    update_font_cache()
+
+    print("Removing '{}' finished".format(family))
 
-        print("Removing '{}' finished".format(family))
+
+def update_font_cache():
+    """Rebuild fontconfig cache if fc-cache is available"""
+
+    if shutil.which("fc-cache"):
+        with tracing.span("fc-cache"):
+            subprocess.call("fc-cache")
 
 
 def get_available_updates() -> List[str]:
@@ -353,22 +770,77 @@ def get_available_updates() -> List[str]:
     families = []
 
     for family in get_installed_families():
-        family = resolve_family(family)
-        lastModified = datetime.fromisoformat(get_metadata(family, False)["lastModified"])
-
-        if lastModified.timestamp() > time.time():
+        if is_family_outdated(family):
             families.append(family)
 
     return families
 
 
-def pack_webfonts(family: str, woff: bool, dir: str, clean: bool, styles: str = "", **parameters: Optional[str]):
-    """Pack a font family to use in websites as self-hosted fonts"""
+def get_font_faces(css: str) -> List[Dict[str, Optional[str]]]:
+    """Parse @font-face rules of Google Fonts CSS
+
+    :return: List of dictionary contains 'url', 'style', 'weight' and 'subset' properties. 'subset' is the comment
+        before the rule, e.g. 'latin' or '[0]' for numbered slices of CJK families, None if there is no comment.
+    """
+
+    utils.isinstance_check(css, str, "First argument 'css' must be 'str'")
+
+    faces = []
+
+    for [subset, rule] in re.findall(r"(?:/\*\s*([^*]*?)\s*\*/\s*)?@font-face\s*{([^}]*)}", css):
+        properties = dict(re.findall(r"([\w-]+)\s*:\s*([^;]+)", rule))
+        url = re.search(r"url\(([^\)]+)\)", rule)
+
+        faces.append(
+            {
+                "url": url.group(1) if url else None,
+                "style": properties.get("font-style", "normal").strip(),
+                "weight": properties.get("font-weight", "400").strip(),
+                "subset": subset or None,
+            }
+        )
+
+    return faces
+
+
+def match_font_face(face: Dict, variant: str) -> bool:
+    """Check a font face from get_font_faces covers the variant (e.g. '400', '700i'), weight ranges of variable fonts are supported"""
+
+    weights = [int(x) for x in face["weight"].split()]
+    weight = int(variant.rstrip("i"))
+
+    return (face["style"] == "italic") == variant.endswith("i") and weights[0] <= weight <= weights[-1]
+
+
+def pack_webfonts(
+    family: str,
+    woff: bool,
+    dir: str,
+    clean: bool,
+    styles: str = "",
+    minify: bool = False,
+    precompress: bool = False,
+    preload: Optional[List[str]] = None,
+    preload_subset: Optional[str] = "latin",
+    inline_below: int = 0,
+    **parameters: Optional[str],
+):
+    """Pack a font family to use in websites as self-hosted fonts
+
+    A manifest with file sizes and <link rel="preload"> snippets is written next to the CSS file.
+
+    :param minify: remove comments and whitespaces from CSS
+    :param precompress: write .gz and .br files next to CSS and not already compressed (ttf, otf) fonts
+    :param preload: variants (e.g. '400', '700i') to create preload snippets for
+    :param preload_subset: only preload faces of this subset, None for all subsets
+    :param inline_below: fonts smaller than this number of bytes are inlined into CSS as data URIs
+    """
 
     utils.isinstance_check(family, str, "First argument 'family' must be 'str'")
     utils.isinstance_check(dir, str, "Second argument 'dir' must be 'str'")
     utils.isinstance_check(clean, bool, "Third argument 'clean' must be 'bool'")
     utils.isinstance_check(styles, str, "Fourth argument 'styles' must be 'str'")
+    utils.isinstance_check(inline_below, int, "Argument 'inline_below' must be 'int'")
 
     family = resolve_family(family)
     family_kebab = utils.kebab_case(family)
@@ -383,8 +855,63 @@ def pack_webfonts(family: str, woff: bool, dir: str, clean: bool, styles: str =
         utils.empty_directory(subdir)
     download_fonts(family, fonts, subdir, True)
 
+    faces = get_font_faces(webfonts_css)
+
     for font in fonts:
-        webfonts_css = webfonts_css.replace(font["url"], f"{family_kebab}/" + font["filename"])
-    utils.write_file(f"{dir}/{family_kebab}.css", webfonts_css)
+        filepath = os.path.join(subdir, font["filename"])
+        font["size"] = os.path.getsize(filepath)
+        font["inlined"] = font["size"] < inline_below
+
+        if font["inlined"]:
+            webfonts_css = webfonts_css.replace(font["url"], utils.data_uri(filepath))
+            os.remove(filepath)
+        else:
+            webfonts_css = webfonts_css.replace(font["url"], f"{family_kebab}/" + font["filename"])
+
+            # woff and woff2 fonts are already compressed
+            if precompress and not font["filename"].endswith((".woff", ".woff2")):
+                font["precompressed"] = utils.write_precompressed(filepath)
+
+    if minify:
+        webfonts_css = utils.minify_css(webfonts_css)
+
+    css_filepath = f"{dir}/{family_kebab}.css"
+    utils.write_file(css_filepath, webfonts_css)
+
+    preload_links = []
+
+    # CSS for a single subset or for 'text' parameter has no subset comments, all of its faces are preloaded
+    preload_subset = preload_subset if any(face["subset"] for face in faces) else None
+
+    for font in fonts:
+        if font["inlined"]:
+            continue
+
+        for face in faces:
+            if face["url"] != font["url"] or (preload_subset and face["subset"] != preload_subset):
+                continue
+
+            if any(match_font_face(face, variant) for variant in utils.resolve_variants(preload or [], True)):
+                font_type = "font/" + font["filename"].split(".")[-1]
+                preload_links.append(f'<link rel="preload" href="{family_kebab}/{font["filename"]}" as="font" type="{font_type}" crossorigin>')
+                break
+
+    manifest = {
+        "family": family,
+        "css": {
+            "filename": f"{family_kebab}.css",
+            "size": os.path.getsize(css_filepath),
+            "precompressed": utils.write_precompressed(css_filepath) if precompress else None,
+        },
+        "fonts": [
+            {
+                **{x: y for [x, y] in font.items() if x != "url"},
+                "faces": [{x: y for [x, y] in face.items() if x != "url"} for face in faces if face["url"] == font["url"]],
+            }
+            for font in sorted(fonts, key=lambda x: x["filename"])
+        ],
+        "preload": preload_links,
+    }
+    utils.write_file(f"{dir}/{family_kebab}.manifest.json", json.dumps(manifest, indent=4))
 
     print(f"Packing '{family}' webfonts finished.")
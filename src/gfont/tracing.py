@@ -0,0 +1,89 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, TextIO
+
+__enabled = False
+__events: List[Dict] = []
+__stream: Optional[TextIO] = None
+__lock = threading.Lock()
+
+
+def enable(stream: Optional[TextIO] = None):
+    """Start recording spans.
+
+    :param stream: if given, every finished span is written into it as a line of json
+    """
+
+    global __enabled
+    global __stream
+
+    __enabled = True
+    __stream = stream
+
+
+def is_enabled() -> bool:
+    return __enabled
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Measure the time spent inside the block, used as `with tracing.span("name") as attributes:`
+
+    Attributes can be added to the yielded dictionary inside the block, they are recorded with the span.
+    When tracing isn't enabled, only the dictionary is created.
+    """
+
+    if not __enabled:
+        yield attributes
+        return
+
+    started_at = time.time()
+    start = time.perf_counter()
+
+    try:
+        yield attributes
+    except BaseException as error:
+        attributes["error"] = type(error).__name__
+        raise
+    finally:
+        record({"name": name, "start": started_at, "duration": time.perf_counter() - start, "thread": threading.current_thread().name, **attributes})
+
+
+def record(event: Dict):
+    with __lock:
+        __events.append(event)
+
+        if __stream:
+            __stream.write(json.dumps(event) + "\n")
+
+
+def get_events() -> List[Dict]:
+    with __lock:
+        return list(__events)
+
+
+def print_summary(file: TextIO = sys.stderr):
+    """Print count, total, mean and max duration of recorded spans grouped by name"""
+
+    groups: Dict[str, Dict] = {}
+
+    for event in get_events():
+        group = groups.setdefault(event["name"], {"count": 0, "total": 0.0, "max": 0.0, "bytes": 0, "hits": 0, "reused": 0})
+        group["count"] += 1
+        group["total"] += event["duration"]
+        group["max"] = max(group["max"], event["duration"])
+        group["bytes"] += event.get("bytes", 0)
+        group["hits"] += event.get("cache") == "hit"
+        group["reused"] += bool(event.get("reused"))
+
+    print(f"{'span':<20}{'count':>7}{'total ms':>11}{'mean ms':>10}{'max ms':>10}{'bytes':>12}{'cache hit':>11}{'reused':>8}", file=file)
+
+    for [name, group] in sorted(groups.items(), key=lambda x: -x[1]["total"]):
+        print(
+            f"{name:<20}{group['count']:>7}{group['total'] * 1000:>11.1f}{group['total'] / group['count'] * 1000:>10.1f}"
+            f"{group['max'] * 1000:>10.1f}{group['bytes']:>12}{group['hits']:>11}{group['reused']:>8}",
+            file=file,
+        )
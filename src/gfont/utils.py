@@ -1,14 +1,38 @@
+import base64
+import fcntl
+import gzip
+import hashlib
+import json
 import os
 import random
+import re
 import socket
+import struct
 import sys
+import threading
 import time
+import weakref
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List
-
-from requests import request
-
-from .constants import FONT_VARIANT_STANDARD_NAMES, MAX_WORKERS
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from requests import Response, Session
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from . import tracing
+from .constants import (
+    CONNECTIVITY_CHECK_ADDRESS,
+    FONT_FILE_SIGNATURES,
+    FONT_VARIANT_PRIORITY,
+    FONT_VARIANT_STANDARD_NAMES,
+    MAX_WORKERS,
+    REQUEST_TIMEOUT,
+)
 
 LOG_COLORS = {
     "DEBUG": "\033[34m",  # Blue
@@ -21,6 +45,10 @@ LOG_COLORS = {
 
 __generated_unique_name = []
 __is_online: None | bool = None
+__rate_limiter: Optional["RateLimiter"] = None
+__session = Session()
+__seen_connections: weakref.WeakSet = weakref.WeakSet()
+__is_brotli_warned = False
 
 
 def check_internet_connection(host, port):
@@ -42,7 +70,9 @@ def check_internet_connection(host, port):
 
 
 def need_internet_connection():
-    if not check_internet_connection("8.8.8.8", 53):
+    [host, port] = CONNECTIVITY_CHECK_ADDRESS.rsplit(":", 1)
+
+    if not check_internet_connection(host, int(port)):
         log("ERROR", "No Internet Connection")
         sys.exit(1)
 
@@ -106,20 +136,113 @@ def write_file(filepath: str, content: str):
     isinstance_check(filepath, str, "First argument 'filepath' must be 'str'")
     isinstance_check(content, str, "Second argument 'content' must be 'str'")
 
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    with open(filepath, "w") as file:
-        file.write(content)
-        file.close()
+    atomic_write(filepath, content.encode())
 
 
 def write_bytes_file(filepath: str, content: bytes):
     isinstance_check(filepath, str, "First argument 'filepath' must be 'str'")
     isinstance_check(content, bytes, "Second argument 'content' must be 'bytes'")
 
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    with open(filepath, "wb") as file:
-        file.write(content)
-        file.close()
+    atomic_write(filepath, content)
+
+
+def atomic_write(filepath: str, content: bytes):
+    """
+    Write into a temporary file next to {filepath} and rename it over {filepath},
+    so other processes see either the old or the new content, never a partial one
+    """
+
+    isinstance_check(filepath, str, "First argument 'filepath' must be 'str'")
+    isinstance_check(content, bytes, "Second argument 'content' must be 'bytes'")
+
+    dirname = os.path.dirname(filepath)
+    os.makedirs(dirname, exist_ok=True)
+
+    with tracing.span("write", path=filepath, bytes=len(content)):
+        tmppath = os.path.join(dirname, f".{os.path.basename(filepath)}.{unique_name()}.tmp")
+
+        # Created like open() does, so permissions of the written file follow the umask
+        fd = os.open(tmppath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(content)
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.replace(tmppath, filepath)
+        except BaseException:
+            if os.path.isfile(tmppath):
+                os.remove(tmppath)
+            raise
+
+
+@contextmanager
+def file_lock(lockpath: str):
+    """
+    Hold an exclusive lock shared with other processes until the block exits
+    """
+
+    isinstance_check(lockpath, str, "First argument 'lockpath' must be 'str'")
+
+    os.makedirs(os.path.dirname(lockpath), exist_ok=True)
+
+    with open(lockpath, "a") as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def file_sha256(filepath: str) -> str:
+    isinstance_check(filepath, str, "First argument 'filepath' must be 'str'")
+
+    sha256 = hashlib.sha256()
+
+    with open(filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def check_font_file(filepath: str) -> bool:
+    """
+    Check the header of a sfnt, WOFF or WOFF2 font file is valid and the file isn't truncated
+    """
+
+    isinstance_check(filepath, str, "First argument 'filepath' must be 'str'")
+
+    size = os.path.getsize(filepath)
+
+    with open(filepath, "rb") as file:
+        header = file.read(12)
+
+        if len(header) < 12 or header[:4] not in FONT_FILE_SIGNATURES:
+            return False
+
+        # WOFF and WOFF2 headers store the total file size
+        if header[:4] in [b"wOFF", b"wOF2"]:
+            return struct.unpack(">I", header[8:12])[0] == size
+
+        # TrueType Collection, only the header size can be checked
+        if header[:4] == b"ttcf":
+            return True
+
+        # sfnt, every table in the table directory must be inside the file
+        num_tables = struct.unpack(">H", header[4:6])[0]
+        table_directory = file.read(num_tables * 16)
+
+        if num_tables == 0 or len(table_directory) < num_tables * 16:
+            return False
+
+        for i in range(num_tables):
+            offset, length = struct.unpack(">II", table_directory[i * 16 + 8:i * 16 + 16])
+            if offset + length > size:
+                return False
+
+    return True
 
 
 def download_file(url: str, filepath: str, cache_age: int = 0):
@@ -131,10 +254,234 @@ def download_file(url: str, filepath: str, cache_age: int = 0):
         if cache_age > time.time() - os.path.getmtime(filepath):
             return
 
-    res = request("GET", url, timeout=10)
-    res.raise_for_status()
+    write_bytes_file(filepath, http_download(url))
+
+
+def http_get(url: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Send GET request through a shared session, so connections to the same host are reused
+    """
+
+    isinstance_check(url, str, "First argument 'url' must be 'str'")
+
+    with tracing.span("http", url=url) as span:
+        with __send(url, headers, span) as res:
+            span["bytes"] = len(res.content)
+
+    return res
+
+
+def http_download(url: str, progress: Optional["DownloadProgress"] = None) -> bytes:
+    """
+    Download content of {url} in chunks under the rate limit, reporting received bytes to {progress}
+    """
+
+    isinstance_check(url, str, "First argument 'url' must be 'str'")
+
+    with tracing.span("http", url=url) as span, __send(url, None, span) as res:
+        chunks = []
+
+        if progress:
+            progress.start_file(int(res.headers.get("Content-Length", 0)))
+
+        for chunk in res.iter_content(16384):
+            throttle(len(chunk))
+            if progress:
+                progress.update(len(chunk))
+            chunks.append(chunk)
+
+        content = b"".join(chunks)
+        span["bytes"] = len(content)
+
+    return content
+
+
+def __send(url: str, headers: Optional[Dict[str, str]], span: Dict) -> Response:
+    """
+    Send GET request with streamed body, the caller must close the response (e.g. use it as context manager)
+    """
+
+    res = __session.get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True)
+
+    # Body isn't read yet, so the connection is still attached to the response
+    connection = res.raw.connection
+    span["status"] = res.status_code
+    span["reused"] = connection in __seen_connections
+
+    if connection is not None:
+        __seen_connections.add(connection)
+
+    try:
+        res.raise_for_status()
+    except BaseException:
+        res.close()
+        raise
+
+    return res
+
+
+def parse_size(text: str) -> int:
+    """
+    Convert size like '500K', '2M' or '1048576' into bytes
+    """
+
+    isinstance_check(text, str, "First argument 'text' must be 'str'")
+
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    text = text.strip().upper()
+    text = text[:-1] if text.endswith("B") else text
+
+    if text and text[-1] in units:
+        size = float(text[:-1]) * units[text[-1]]
+    else:
+        size = float(text)
+
+    if size <= 0:
+        raise ValueError(f"Size '{text}' must be greater than zero")
+
+    return int(size)
+
+
+def format_size(size: float) -> str:
+    if size < 1024:
+        return f"{int(size)} B"
+
+    for unit in ["KiB", "MiB", "GiB"]:
+        size /= 1024
+        if size < 1024 or unit == "GiB":
+            break
+
+    return f"{size:.1f} {unit}"
+
 
-    write_bytes_file(filepath, res.content)
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m"
+
+
+class RateLimiter:
+    """Token bucket shared by all download threads, limits total bandwidth to {rate} bytes per second"""
+
+    def __init__(self, rate: int):
+        isinstance_check(rate, int, "First argument 'rate' must be 'int'")
+
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: int):
+        """Take {amount} bytes from the bucket, sleep until the bucket can afford them"""
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def set_rate_limit(rate: Optional[int]):
+    """
+    Limit bandwidth of all downloads to {rate} bytes per second, None to remove the limit
+    """
+
+    global __rate_limiter
+
+    __rate_limiter = RateLimiter(rate) if rate else None
+
+
+def throttle(amount: int):
+    """
+    Wait until {amount} bytes are allowed to be received under the rate limit
+    """
+
+    if __rate_limiter:
+        __rate_limiter.consume(amount)
+
+
+class DownloadProgress:
+    """Single progress line aggregated over files downloaded by several threads"""
+
+    def __init__(self, title: str, total_files: int):
+        isinstance_check(title, str, "First argument 'title' must be 'str'")
+        isinstance_check(total_files, int, "Second argument 'total_files' must be 'int'")
+
+        self.title = title
+        self.total_files = total_files
+        self.finished_files = 0
+        self.started_files = 0
+        self.total_bytes = 0
+        self.received_bytes = 0
+        self.started = time.monotonic()
+        self.printed = 0.0
+        self.lock = threading.Lock()
+
+        self.print()
+
+    def start_file(self, size: int):
+        """Register a new download with its size from Content-Length, 0 if unknown"""
+
+        with self.lock:
+            self.started_files += 1
+            self.total_bytes += size
+
+    def update(self, amount: int):
+        with self.lock:
+            self.received_bytes += amount
+
+            # Redrawing the line for every chunk is wasteful, 10 times per second is enough
+            if time.monotonic() - self.printed >= 0.1:
+                self.print()
+
+    def finish_file(self):
+        with self.lock:
+            self.finished_files += 1
+            self.print()
+
+    def print(self):
+        self.printed = time.monotonic()
+
+        width = len(str(self.total_files))
+        line = f"{self.title} ({str(self.finished_files).rjust(width, '0')}/{self.total_files})"
+
+        if self.received_bytes:
+            elapsed = max(self.printed - self.started, 0.001)
+            speed = self.received_bytes / elapsed
+
+            # Files not started yet are assumed to have the average size of started ones
+            average_size = self.total_bytes / self.started_files if self.started_files else 0
+            expected_bytes = self.total_bytes + average_size * (self.total_files - self.started_files)
+            eta = max(expected_bytes - self.received_bytes, 0) / speed
+
+            line += f" {format_size(self.received_bytes)}/{format_size(expected_bytes)}"
+            line += f" {format_size(speed)}/s ETA {format_duration(eta)}"
+
+        print(line, end="\033[K\r", flush=True)
+
+
+def variant_priority(variant: Optional[str]):
+    """
+    Sort key to download the most used variants first, unknown variants keep their order at the end
+    """
+
+    if variant is None:
+        return (2, 0, 0)
+
+    if variant in FONT_VARIANT_PRIORITY:
+        return (0, FONT_VARIANT_PRIORITY.index(variant), 0)
+
+    # Other variants, upright first and closer to regular weight first
+    return (1, variant.endswith("i"), abs(int(variant.rstrip("i")) - 400))
 
 
 def thread_pool_loop(func, items, *args):
@@ -143,6 +490,116 @@ def thread_pool_loop(func, items, *args):
         return [future.result() for future in as_completed(futures)]
 
 
+def thread_pool_imap(func, items: Iterable, *args) -> Iterator:
+    """
+    Like thread_pool_loop, but yield results lazily in the order of {items}, running a few items ahead
+    """
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pending = deque()
+
+        for item in items:
+            pending.append(executor.submit(func, item, *args))
+
+            if len(pending) >= MAX_WORKERS * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def format_records(records: Iterable[Dict], format: str, columns: List[str]) -> Iterator[str]:
+    """
+    Yield {records} as chunks of 'json', 'jsonl' or 'tsv' output. Only {columns} are written in tsv.
+    """
+
+    isinstance_check(format, str, "Second argument 'format' must be 'str'")
+
+    def _tsv_value(value) -> str:
+        if isinstance(value, list):
+            return ",".join(_tsv_value(x) for x in value)
+        if isinstance(value, dict):
+            return ";".join(f"{x}={y}" for [x, y] in value.items())
+        return " ".join(str(value).split())
+
+    if format == "json":
+        separator = "["
+        for record in records:
+            yield f"{separator}\n    {json.dumps(record)}"
+            separator = ","
+        yield "\n]\n" if separator == "," else "[]\n"
+
+    elif format == "jsonl":
+        for record in records:
+            yield json.dumps(record) + "\n"
+
+    elif format == "tsv":
+        yield "\t".join(columns) + "\n"
+        for record in records:
+            yield "\t".join(_tsv_value(record.get(column, "")) for column in columns) + "\n"
+
+    else:
+        raise ValueError(f"Format '{format}' is not supported")
+
+
+def minify_css(css: str) -> str:
+    """
+    Remove comments and unnecessary whitespaces from CSS, quoted strings are kept as they are
+    """
+
+    isinstance_check(css, str, "First argument 'css' must be 'str'")
+
+    quoted = r"(\"[^\"]*\"|'[^']*')"
+
+    css = re.sub(quoted + r"|/\*.*?\*/|\s+", lambda x: x.group(1) or ("" if x.group(0).startswith("/*") else " "), css, flags=re.S)
+    css = re.sub(quoted + r"|\s*([{}:;,])\s*", lambda x: x.group(1) or x.group(2), css)
+
+    return css.replace(";}", "}").strip()
+
+
+def data_uri(filepath: str) -> str:
+    isinstance_check(filepath, str, "First argument 'filepath' must be 'str'")
+
+    mime_types = {".woff2": "font/woff2", ".woff": "font/woff", ".ttf": "font/ttf", ".otf": "font/otf"}
+    mime_type = mime_types.get(os.path.splitext(filepath)[1].lower(), "application/octet-stream")
+
+    with open(filepath, "rb") as file:
+        return f"data:{mime_type};base64,{base64.b64encode(file.read()).decode()}"
+
+
+def write_precompressed(filepath: str) -> Dict[str, Optional[int]]:
+    """
+    Write gzip (.gz) and brotli (.br) compressed copies next to {filepath}.
+    Brotli is skipped if 'brotli' package isn't installed.
+
+    :return: Dictionary of sizes of compressed files, None for skipped ones
+    """
+
+    global __is_brotli_warned
+
+    isinstance_check(filepath, str, "First argument 'filepath' must be 'str'")
+
+    with open(filepath, "rb") as file:
+        content = file.read()
+
+    # mtime=0 keeps the output identical between runs
+    gzipped = gzip.compress(content, 9, mtime=0)
+    write_bytes_file(filepath + ".gz", gzipped)
+    sizes: Dict[str, Optional[int]] = {"gzip": len(gzipped), "brotli": None}
+
+    if brotli is None:
+        if not __is_brotli_warned:
+            log("WARNING", "Install 'brotli' package to write .br files")
+            __is_brotli_warned = True
+        return sizes
+
+    brotlied = brotli.compress(content, quality=11)
+    write_bytes_file(filepath + ".br", brotlied)
+    sizes["brotli"] = len(brotlied)
+
+    return sizes
+
+
 def resolve_variant(variant: str, short: bool):
     _variant = variant
 
@@ -0,0 +1,15 @@
+import struct
+
+
+def make_sfnt(body_size: int = 64, signature: bytes = b"\x00\x01\x00\x00") -> bytes:
+    """sfnt file with a single table covering the whole body"""
+
+    header = signature + struct.pack(">HHHH", 1, 16, 0, 0)
+    header += b"glyf" + struct.pack(">III", 0, 28, body_size)
+    return header + b"\x00" * body_size
+
+
+def make_woff(body_size: int = 64, signature: bytes = b"wOF2") -> bytes:
+    """WOFF or WOFF2 file, its header stores the total file size"""
+
+    return signature + b"\x00\x01\x00\x00" + struct.pack(">I", 12 + body_size) + b"\x00" * body_size
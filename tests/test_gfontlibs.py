@@ -0,0 +1,516 @@
+import json
+import os
+
+import pytest
+from fonts import make_sfnt, make_woff
+
+from gfont import gfontlibs as libs
+from gfont import utils
+from gfont.constants import MANIFEST_FILENAME
+
+FONTS = [
+    {"filename": "Test_Sans-Regular.ttf", "url": "https://example.com/regular.ttf", "variant": "400"},
+    {"filename": "Test_Sans-Bold.woff2", "url": "https://example.com/bold.woff2", "variant": "700"},
+]
+
+
+@pytest.fixture
+def fonts_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(libs, "FONTS_DIR", str(tmp_path))
+    monkeypatch.setattr(libs, "resolve_family", lambda family, exact=False: family)
+    monkeypatch.setattr(libs, "get_font_files", lambda family: [dict(font) for font in FONTS])
+
+    family_dir = tmp_path / "Test_Sans"
+    family_dir.mkdir()
+    (family_dir / "Test_Sans-Regular.ttf").write_bytes(make_sfnt(128))
+    (family_dir / "Test_Sans-Bold.woff2").write_bytes(make_woff(128))
+
+    return family_dir
+
+
+def broken_reasons(broken):
+    return {font["filename"]: font["reason"] for font in broken.get("Test Sans", [])}
+
+
+def test_write_manifest(fonts_dir):
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2025-01-01")
+    manifest = libs.read_manifest(str(fonts_dir))
+
+    assert manifest["lastModified"] == "2025-01-01"
+    assert manifest["files"]["Test_Sans-Regular.ttf"] == {
+        "url": FONTS[0]["url"],
+        "size": os.path.getsize(fonts_dir / "Test_Sans-Regular.ttf"),
+        "sha256": utils.file_sha256(str(fonts_dir / "Test_Sans-Regular.ttf")),
+    }
+
+
+def test_read_manifest_unreadable(fonts_dir):
+    (fonts_dir / MANIFEST_FILENAME).write_text("{")
+
+    assert libs.read_manifest(str(fonts_dir)) is None
+
+
+def test_verify_families_intact(fonts_dir):
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2025-01-01")
+
+    assert libs.verify_families(["Test Sans"]) == {}
+
+
+def test_verify_families_missing_file(fonts_dir):
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2025-01-01")
+    os.remove(fonts_dir / "Test_Sans-Bold.woff2")
+
+    assert broken_reasons(libs.verify_families(["Test Sans"])) == {"Test_Sans-Bold.woff2": "missing"}
+
+
+def test_verify_families_size_mismatch(fonts_dir):
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2025-01-01")
+    (fonts_dir / "Test_Sans-Regular.ttf").write_bytes(make_sfnt(64))
+
+    assert broken_reasons(libs.verify_families(["Test Sans"])) == {"Test_Sans-Regular.ttf": "size mismatch"}
+
+
+def test_verify_families_checksum_mismatch(fonts_dir):
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2025-01-01")
+    content = bytearray(make_sfnt(128))
+    content[-1] = 1
+    (fonts_dir / "Test_Sans-Regular.ttf").write_bytes(bytes(content))
+
+    assert broken_reasons(libs.verify_families(["Test Sans"])) == {"Test_Sans-Regular.ttf": "checksum mismatch"}
+
+
+def test_verify_families_invalid_header(fonts_dir):
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2025-01-01")
+    (fonts_dir / "Test_Sans-Bold.woff2").write_bytes(b"\x00" * len(make_woff(128)))
+
+    assert broken_reasons(libs.verify_families(["Test Sans"])) == {"Test_Sans-Bold.woff2": "invalid font header"}
+
+
+def test_verify_families_without_manifest(fonts_dir):
+    assert libs.verify_families(["Test Sans"]) == {}
+
+    # Without manifest only missing files and broken headers can be detected
+    (fonts_dir / "Test_Sans-Regular.ttf").write_bytes(make_sfnt(128)[:-1])
+    os.remove(fonts_dir / "Test_Sans-Bold.woff2")
+
+    assert broken_reasons(libs.verify_families(["Test Sans"])) == {
+        "Test_Sans-Regular.ttf": "invalid font header",
+        "Test_Sans-Bold.woff2": "missing",
+    }
+
+
+def test_verify_families_broken_font_keeps_url(fonts_dir):
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2025-01-01")
+    os.remove(fonts_dir / "Test_Sans-Regular.ttf")
+
+    [font] = libs.verify_families(["Test Sans"])["Test Sans"]
+
+    assert font["url"] == FONTS[0]["url"]
+
+
+def test_is_family_outdated(fonts_dir, monkeypatch):
+    monkeypatch.setattr(libs, "get_metadata", lambda family, need_extra: {"lastModified": "2025-01-01"})
+
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2025-01-01")
+    assert not libs.is_family_outdated("Test Sans")
+
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2020-01-01")
+    assert libs.is_family_outdated("Test Sans")
+
+
+def test_manifest_json_is_sorted(fonts_dir):
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), None)
+
+    with open(fonts_dir / MANIFEST_FILENAME) as file:
+        assert list(json.load(file)["files"]) == ["Test_Sans-Bold.woff2", "Test_Sans-Regular.ttf"]
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def test_get_families_axes(monkeypatch):
+    axes = [{"tag": "wght", "min": 100.0, "max": 900.0, "defaultValue": 400.0}]
+    text = ")]}'\n" + json.dumps({"familyMetadataList": [{"family": "Test Sans", "axes": axes}, {"family": "Test Serif"}]})
+    monkeypatch.setattr(utils, "http_get", lambda url: FakeResponse(text))
+
+    assert libs.get_families_axes() == {"Test Sans": axes, "Test Serif": []}
+
+
+def test_get_families_axes_unavailable(monkeypatch, capsys):
+    monkeypatch.setattr(utils, "http_get", lambda url: FakeResponse("<html>"))
+
+    assert libs.get_families_axes() == {}
+    assert "WARNING" in capsys.readouterr().err
+
+
+def test_build_index_variable():
+    families = {
+        "test_sans": {"family": "Test Sans", "category": "sans-serif", "subsets": [], "variants": [], "lastModified": "2025-01-01", "axes": [{"tag": "wght"}]},
+        "test_serif": {"family": "Test Serif", "category": "serif", "subsets": [], "variants": [], "lastModified": "2025-01-01", "axes": []},
+    }
+
+    assert libs.build_index(families, None)["variable"] == ["Test Sans"]
+
+
+def test_iter_metadata_skips_failed_families(monkeypatch, capsys):
+    def _get_metadata(family, need_extra, save=True):
+        if family == "Broken Sans" and need_extra:
+            raise ValueError("invalid metadata")
+        return {"family": family, "designers": [], "license": "ofl", "axes": []}
+
+    monkeypatch.setattr(libs, "get_metadata", _get_metadata)
+
+    assert [x["family"] for x in libs.iter_metadata(["Test Sans", "Broken Sans", "Test Serif"], True)] == ["Test Sans", "Test Serif"]
+    assert "Broken Sans" in capsys.readouterr().err
+
+
+@pytest.fixture
+def install(fonts_dir, tmp_path, monkeypatch):
+    """Install 'Test Sans' of version 2025-01-01 without network, return filenames of each download"""
+
+    downloads = []
+
+    def _download_fonts(family, fonts, dir, nocache=False):
+        downloads.append(sorted(x["filename"] for x in fonts))
+        for font in fonts:
+            content = make_sfnt(128) if font["filename"].endswith(".ttf") else make_woff(128)
+            (fonts_dir / font["filename"]).write_bytes(content)
+
+    monkeypatch.setattr(libs, "LOCKS_DIR", str(tmp_path / "locks"))
+    monkeypatch.setattr(libs, "get_metadata", lambda family, need_extra: {"lastModified": "2025-01-01"})
+    monkeypatch.setattr(libs, "download_fonts", _download_fonts)
+    monkeypatch.setattr(libs, "update_font_cache", lambda: None)
+
+    return downloads
+
+
+def test_install_family_downloads_corrupted_files_again(fonts_dir, install):
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2025-01-01")
+    content = bytearray(make_sfnt(128))
+    content[-1] = 1
+    (fonts_dir / "Test_Sans-Regular.ttf").write_bytes(bytes(content))
+
+    libs.install_family("Test Sans")
+
+    assert install == [["Test_Sans-Regular.ttf"]]
+    assert libs.verify_families(["Test Sans"]) == {}
+
+
+def test_install_family_keeps_manifest_of_skipped_files(fonts_dir, install):
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), "2025-01-01")
+    expected = libs.read_manifest(str(fonts_dir))["files"]["Test_Sans-Bold.woff2"]
+
+    libs.install_family("Test Sans")
+
+    assert install == [[]]
+    assert libs.read_manifest(str(fonts_dir))["files"]["Test_Sans-Bold.woff2"] == expected
+
+
+def test_is_family_outdated_without_manifest(fonts_dir, monkeypatch):
+    monkeypatch.setattr(libs, "get_metadata", lambda family, need_extra: {"lastModified": "2025-01-01"})
+
+    # Files downloaded after the version was released are not downloaded again
+    assert not libs.is_family_outdated("Test Sans")
+
+    os.utime(fonts_dir / "Test_Sans-Bold.woff2", (0, 0))
+    assert libs.is_family_outdated("Test Sans")
+
+    libs.write_manifest("Test Sans", FONTS, str(fonts_dir), None)
+    assert libs.is_family_outdated("Test Sans")
+
+
+def test_install_family_without_manifest_keeps_files(fonts_dir, install):
+    os.remove(fonts_dir / "Test_Sans-Bold.woff2")
+
+    libs.install_family("Test Sans")
+
+    assert install == [["Test_Sans-Bold.woff2"]]
+    assert libs.read_manifest(str(fonts_dir))["lastModified"] == "2025-01-01"
+
+
+def family_metadata(family: str, lastModified: str, **extra) -> dict:
+    return {"family": family, "category": "sans-serif", "subsets": ["latin"], "variants": ["400"], "lastModified": lastModified, **extra}
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Cache file of two families, other processes write into it with write_cache"""
+
+    monkeypatch.setattr(libs, "CACHE_FILE", str(tmp_path / "families.json"))
+    monkeypatch.setattr(libs, "INDEX_FILE", str(tmp_path / "index.json"))
+    monkeypatch.setattr(libs, "LOCKS_DIR", str(tmp_path / "locks"))
+    monkeypatch.setattr(libs, "__families", {})
+    monkeypatch.setattr(libs, "__families_list", [])
+    monkeypatch.setattr(libs, "__families_mtime", None)
+    monkeypatch.setattr(libs, "__index", None)
+
+    def write_cache(families: dict, mtime: float):
+        (tmp_path / "families.json").write_text(json.dumps(families))
+        os.utime(tmp_path / "families.json", (mtime, mtime))
+
+    write_cache({"test_sans": family_metadata("Test Sans", "2025-01-01"), "test_serif": family_metadata("Test Serif", "2025-01-01")}, 1000)
+
+    return write_cache
+
+
+def read_cache(tmp_path) -> dict:
+    return json.loads((tmp_path / "families.json").read_text())
+
+
+EXTRA = {"designers": ["Designer"], "license": "ofl", "axes": []}
+
+
+def test_save_families_keeps_newer_catalog_of_other_process(cache, tmp_path):
+    libs.get_families()
+
+    # Another process refreshed the catalog after it was loaded
+    cache({"test_sans": family_metadata("Test Sans", "2025-02-01"), "test_serif": family_metadata("Test Serif", "2025-01-01"), "new_sans": family_metadata("New Sans", "2025-02-01")}, 2000)
+
+    for family in ["Test Sans", "Test Serif"]:
+        libs.get_metadata(family, False).update(EXTRA)
+
+    libs.save_families()
+    families = read_cache(tmp_path)
+
+    assert families["test_sans"] == family_metadata("Test Sans", "2025-02-01")
+    assert families["test_serif"] == family_metadata("Test Serif", "2025-01-01", **EXTRA)
+    assert libs.get_families() == ["New Sans", "Test Sans", "Test Serif"]
+
+
+def test_save_families_keeps_extra_metadata_of_other_process(cache, tmp_path):
+    libs.get_families()
+    libs.get_metadata("Test Sans", False).update(EXTRA)
+    libs.save_families()
+
+    # Another process fetched extra metadata of the other family meanwhile
+    families = read_cache(tmp_path)
+    families["test_serif"].update(EXTRA)
+    cache(families, 3000)
+
+    libs.save_families()
+
+    assert read_cache(tmp_path) == {"test_sans": family_metadata("Test Sans", "2025-01-01", **EXTRA), "test_serif": family_metadata("Test Serif", "2025-01-01", **EXTRA)}
+
+
+def test_save_families_refreshed_catalog_keeps_extra_metadata(cache, tmp_path, monkeypatch):
+    cache({"test_sans": family_metadata("Test Sans", "2025-01-01", **EXTRA)}, 1000)
+
+    # Catalog fetched by this process is newer than the cache file
+    monkeypatch.setattr(libs, "__families", {"test_sans": family_metadata("Test Sans", "2025-01-01"), "test_serif": family_metadata("Test Serif", "2025-02-01")})
+    libs.save_families()
+
+    assert read_cache(tmp_path) == {"test_sans": family_metadata("Test Sans", "2025-01-01", **EXTRA), "test_serif": family_metadata("Test Serif", "2025-02-01")}
+
+
+CSS = """/* latin-ext */
+@font-face {
+  font-family: 'Test Sans';
+  font-style: normal;
+  font-weight: 400;
+  src: url(https://example.com/400-latin-ext.woff2) format('woff2');
+}
+/* latin */
+@font-face {
+  font-family: 'Test Sans';
+  font-style: normal;
+  font-weight: 400;
+  src: url(https://example.com/400-latin.woff2) format('woff2');
+}
+/* latin */
+@font-face {
+  font-family: 'Test Sans';
+  font-style: italic;
+  font-weight: 100 900;
+  src: url(https://example.com/italic-latin.woff2) format('woff2');
+}
+/* latin */
+@font-face {
+  font-family: 'Test Sans';
+  font-style: normal;
+  font-weight: 700;
+  src: url(https://example.com/700-latin.woff2) format('woff2');
+}
+"""
+
+CJK_CSS = """/* [0] */
+@font-face {
+  font-family: 'Test Sans JP';
+  font-style: normal;
+  font-weight: 400;
+  src: url(https://example.com/0.woff2) format('woff2');
+}
+/* [1] */
+@font-face {
+  font-family: 'Test Sans JP';
+  font-style: normal;
+  font-weight: 400;
+  src: url(https://example.com/1.woff2) format('woff2');
+}
+"""
+
+TEXT_CSS = """@font-face {
+  font-family: 'Test Sans';
+  font-style: normal;
+  font-weight: 400;
+  src: url(https://example.com/text.woff2) format('woff2');
+}
+"""
+
+
+def test_get_font_faces():
+    assert libs.get_font_faces(CSS)[1:3] == [
+        {"url": "https://example.com/400-latin.woff2", "style": "normal", "weight": "400", "subset": "latin"},
+        {"url": "https://example.com/italic-latin.woff2", "style": "italic", "weight": "100 900", "subset": "latin"},
+    ]
+
+
+def test_get_font_faces_numbered_slices_and_no_comments():
+    assert [x["subset"] for x in libs.get_font_faces(CJK_CSS)] == ["[0]", "[1]"]
+    assert [x["subset"] for x in libs.get_font_faces(TEXT_CSS)] == [None]
+
+
+@pytest.mark.parametrize(
+    "style, weight, variant, matched",
+    [
+        ("normal", "400", "400", True),
+        ("normal", "400", "700", False),
+        ("normal", "400", "400i", False),
+        ("italic", "400", "400i", True),
+        ("italic", "400", "400", False),
+        ("normal", "100 900", "100", True),
+        ("normal", "100 900", "650", True),
+        ("normal", "100 900", "900", True),
+        ("normal", "200 800", "900", False),
+        ("italic", "100 900", "700i", True),
+    ],
+)
+def test_match_font_face(style, weight, variant, matched):
+    assert libs.match_font_face({"style": style, "weight": weight}, variant) == matched
+
+
+@pytest.fixture
+def pack(tmp_path, monkeypatch):
+    """Pack webfonts of the given CSS without network, fonts of '700' urls are small"""
+
+    filenames = {}
+
+    def _download_fonts(family, fonts, dir, nocache=False):
+        os.makedirs(dir, exist_ok=True)
+        for font in fonts:
+            filenames[font["url"]] = font["filename"]
+            with open(os.path.join(dir, font["filename"]), "wb") as file:
+                file.write(b"x" * (100 if "700" in font["url"] else 10000))
+
+    monkeypatch.setattr(libs, "resolve_family", lambda family, exact=False: family)
+    monkeypatch.setattr(libs, "download_fonts", _download_fonts)
+
+    def _pack(css, **options):
+        monkeypatch.setattr(libs, "get_webfonts_css", lambda family, woff, styles="", **parameters: css)
+        libs.pack_webfonts("Test Sans", True, str(tmp_path), False, **options)
+
+        with open(tmp_path / "test-sans.manifest.json") as file:
+            manifest = json.load(file)
+
+        return manifest, (tmp_path / "test-sans.css").read_text(), filenames
+
+    return _pack
+
+
+def preload_link(filename: str) -> str:
+    return f'<link rel="preload" href="test-sans/{filename}" as="font" type="font/woff2" crossorigin>'
+
+
+def test_pack_webfonts_inlines_small_fonts(pack, tmp_path):
+    [manifest, css, filenames] = pack(CSS, inline_below=1000)
+    inlined = filenames["https://example.com/700-latin.woff2"]
+
+    assert "url(data:font/woff2;base64," in css
+    assert f"test-sans/{filenames['https://example.com/400-latin.woff2']}" in css
+    assert not os.path.exists(tmp_path / "test-sans" / inlined)
+    assert [x["inlined"] for x in manifest["fonts"] if x["filename"] == inlined] == [True]
+
+
+def test_pack_webfonts_preload(pack):
+    [manifest, _css, filenames] = pack(CSS, preload=["400", "700i"])
+
+    assert sorted(manifest["preload"]) == sorted(
+        [preload_link(filenames["https://example.com/400-latin.woff2"]), preload_link(filenames["https://example.com/italic-latin.woff2"])]
+    )
+
+
+def test_pack_webfonts_preload_all_subsets(pack):
+    [manifest, _css, _filenames] = pack(CSS, preload=["400"], preload_subset=None)
+
+    assert len(manifest["preload"]) == 2
+
+
+def test_pack_webfonts_preload_skips_numbered_slices(pack):
+    [manifest, _css, _filenames] = pack(CJK_CSS, preload=["400"])
+
+    assert manifest["preload"] == []
+
+
+def test_pack_webfonts_preload_without_subset_comments(pack):
+    [manifest, _css, filenames] = pack(TEXT_CSS, preload=["400"])
+
+    assert manifest["preload"] == [preload_link(filenames["https://example.com/text.woff2"])]
+
+
+CATALOG = {
+    "test_sans": family_metadata("Test Sans", "2025-01-01", subsets=["latin", "cyrillic"], variants=["400", "700"]),
+    "test_serif": {**family_metadata("Test Serif", "2025-03-01", variants=["400", "700i"]), "category": "serif"},
+    "test_mono": {**family_metadata("Test Mono", "2025-02-01", subsets=["latin", "cyrillic"], variants=["400i"]), "category": "monospace"},
+    "test_slab": {**family_metadata("Test Slab", "2025-02-02", subsets=["cyrillic"]), "category": "serif"},
+}
+
+
+@pytest.mark.parametrize(
+    "filters, families",
+    [
+        ({"category": "serif"}, ["Test Serif", "Test Slab"]),
+        ({"subsets": ["cyrillic"]}, ["Test Mono", "Test Sans", "Test Slab"]),
+        ({"category": "serif", "subsets": ["cyrillic"]}, ["Test Slab"]),
+        ({"subsets": ["latin", "cyrillic"]}, ["Test Mono", "Test Sans"]),
+        ({"weights": ["700"]}, ["Test Sans", "Test Serif"]),
+        ({"weights": ["700i"]}, ["Test Serif"]),
+        ({"weights": ["400", "700"]}, ["Test Sans", "Test Serif"]),
+        ({"weights": ["400i"]}, ["Test Mono"]),
+        ({"modified_since": "2025-02-01"}, ["Test Mono", "Test Serif", "Test Slab"]),
+        ({"modified_since": "2025-02-02"}, ["Test Serif", "Test Slab"]),
+        ({"modified_since": "2025-03-02"}, []),
+        ({"category": "serif", "modified_since": "2025-02-03"}, ["Test Serif"]),
+    ],
+)
+def test_query_families(cache, filters, families):
+    cache(CATALOG, 1000)
+
+    assert libs.query_families(**filters) == families
+
+
+def test_query_families_keywords(cache):
+    cache(CATALOG, 1000)
+
+    assert libs.query_families(["se"], category="serif") == ["Test Serif"]
+
+
+def test_get_index_without_loading_families(cache, tmp_path, monkeypatch):
+    cache(CATALOG, 1000)
+    libs.get_index()
+
+    monkeypatch.setattr(libs, "__index", None)
+    monkeypatch.setattr(libs, "get_families", lambda refresh=False: pytest.fail("families metadata are loaded"))
+
+    assert libs.query_families(category="monospace") == ["Test Mono"]
+
+
+def test_get_index_stamps_mtime_of_loaded_families(cache, tmp_path, monkeypatch):
+    cache(CATALOG, 1000)
+    libs.get_families()
+
+    # Index of the cache file written by another process after it was loaded isn't valid for the loaded families
+    cache({"test_sans": CATALOG["test_sans"]}, 2000)
+
+    assert libs.query_families(category="serif") == ["Test Serif", "Test Slab"]
+    assert json.loads((tmp_path / "index.json").read_text())["source_mtime"] == 1000
@@ -0,0 +1,84 @@
+import io
+import json
+
+import pytest
+
+from gfont import tracing
+
+
+@pytest.fixture
+def trace(monkeypatch):
+    """Reset recorded spans, return a function to enable tracing"""
+
+    monkeypatch.setattr(tracing, "__enabled", False)
+    monkeypatch.setattr(tracing, "__events", [])
+    monkeypatch.setattr(tracing, "__stream", None)
+
+    return tracing.enable
+
+
+def test_span_disabled(trace):
+    with tracing.span("get_families", cache="hit") as attributes:
+        attributes["bytes"] = 10
+
+    assert attributes == {"cache": "hit", "bytes": 10}
+    assert tracing.get_events() == []
+
+
+def test_span_enabled(trace):
+    trace()
+
+    with tracing.span("download", filename="a.ttf") as attributes:
+        attributes["bytes"] = 10
+
+    [event] = tracing.get_events()
+
+    assert event["name"] == "download"
+    assert event["filename"] == "a.ttf"
+    assert event["bytes"] == 10
+    assert event["duration"] >= 0
+    assert "error" not in event
+
+
+def test_span_records_error(trace):
+    trace()
+
+    with pytest.raises(ValueError):
+        with tracing.span("http", url="https://example.com"):
+            raise ValueError
+
+    [event] = tracing.get_events()
+
+    assert event["error"] == "ValueError"
+
+
+def test_span_stream(trace):
+    stream = io.StringIO()
+    trace(stream)
+
+    with tracing.span("outer"):
+        with tracing.span("inner", bytes=5):
+            pass
+
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    assert [x["name"] for x in events] == ["inner", "outer"]
+    assert events[0]["bytes"] == 5
+    assert events == tracing.get_events()
+
+
+def test_print_summary(trace):
+    for event in [
+        {"name": "download", "duration": 0.1, "bytes": 100, "cache": "miss"},
+        {"name": "download", "duration": 0.3, "bytes": 200, "cache": "hit"},
+        {"name": "http", "duration": 0.05, "reused": True},
+    ]:
+        tracing.record(event)
+
+    output = io.StringIO()
+    tracing.print_summary(output)
+    [header, download, http] = [line.split() for line in output.getvalue().splitlines()]
+
+    assert header[0] == "span"
+    assert download == ["download", "2", "400.0", "200.0", "300.0", "300", "1", "0"]
+    assert http == ["http", "1", "50.0", "50.0", "50.0", "0", "0", "1"]
@@ -0,0 +1,311 @@
+import json
+import os
+import struct
+import threading
+
+import pytest
+from fonts import make_sfnt, make_woff
+from requests import HTTPError
+
+from gfont import utils
+
+
+def write(tmp_path, name: str, content: bytes) -> str:
+    filepath = tmp_path / name
+    filepath.write_bytes(content)
+    return str(filepath)
+
+
+@pytest.mark.parametrize("signature", [b"\x00\x01\x00\x00", b"true", b"OTTO"])
+def test_check_font_file_valid_sfnt(tmp_path, signature):
+    assert utils.check_font_file(write(tmp_path, "font.ttf", make_sfnt(signature=signature)))
+
+
+@pytest.mark.parametrize("signature", [b"wOFF", b"wOF2"])
+def test_check_font_file_valid_woff(tmp_path, signature):
+    assert utils.check_font_file(write(tmp_path, "font.woff2", make_woff(signature=signature)))
+
+
+def test_check_font_file_truncated_sfnt(tmp_path):
+    assert not utils.check_font_file(write(tmp_path, "font.ttf", make_sfnt()[:-1]))
+
+
+def test_check_font_file_truncated_table_directory(tmp_path):
+    assert not utils.check_font_file(write(tmp_path, "font.ttf", make_sfnt()[:20]))
+
+
+def test_check_font_file_table_past_end_of_file(tmp_path):
+    content = bytearray(make_sfnt(64))
+    content[24:28] = struct.pack(">I", 65)
+
+    assert not utils.check_font_file(write(tmp_path, "font.ttf", bytes(content)))
+
+
+def test_check_font_file_without_tables(tmp_path):
+    content = b"\x00\x01\x00\x00" + struct.pack(">HHHH", 0, 0, 0, 0)
+
+    assert not utils.check_font_file(write(tmp_path, "font.ttf", content))
+
+
+@pytest.mark.parametrize("signature", [b"wOFF", b"wOF2"])
+def test_check_font_file_truncated_woff(tmp_path, signature):
+    assert not utils.check_font_file(write(tmp_path, "font.woff2", make_woff(signature=signature)[:-1]))
+
+
+def test_check_font_file_invalid_signature(tmp_path):
+    assert not utils.check_font_file(write(tmp_path, "font.ttf", b"<html>" + make_sfnt()))
+
+
+def test_check_font_file_empty(tmp_path):
+    assert not utils.check_font_file(write(tmp_path, "font.ttf", b""))
+
+
+def test_file_sha256(tmp_path):
+    filepath = write(tmp_path, "file", b"gfont")
+
+    assert utils.file_sha256(filepath) == "27757b53b9f80bf416cb5b444d4705d158fd8c72bef3b4810a53dcaf370b4dc4"
+
+
+@pytest.mark.parametrize(
+    "text, size",
+    [("1048576", 1048576), ("500K", 512000), ("500k", 512000), ("2M", 2097152), ("1.5MB", 1572864), ("1G", 1073741824)],
+)
+def test_parse_size(text, size):
+    assert utils.parse_size(text) == size
+
+
+@pytest.mark.parametrize("text", ["", "abc", "0", "-1K", "5T"])
+def test_parse_size_invalid(text):
+    with pytest.raises(ValueError):
+        utils.parse_size(text)
+
+
+def test_variant_priority():
+    variants = ["100", "900i", "700", "400i", "300", "700i", "400", "500", "300i"]
+
+    assert sorted(variants, key=utils.variant_priority) == ["400", "700", "400i", "700i", "300", "500", "100", "300i", "900i"]
+
+
+def test_variant_priority_unknown_variants_last():
+    fonts = [{"variant": None, "name": "a"}, {"variant": "900", "name": "b"}, {"variant": None, "name": "c"}]
+
+    assert [x["name"] for x in sorted(fonts, key=lambda x: utils.variant_priority(x["variant"]))] == ["b", "a", "c"]
+
+
+RECORDS = [
+    {"family": "Test Sans", "subsets": ["latin", "latin-ext"], "axes": [{"tag": "wght", "min": 100}]},
+    {"family": "Test Serif", "subsets": [], "axes": []},
+]
+
+
+def test_format_records_json():
+    assert json.loads("".join(utils.format_records(RECORDS, "json", ["family"]))) == RECORDS
+
+
+def test_format_records_json_empty():
+    assert json.loads("".join(utils.format_records([], "json", ["family"]))) == []
+
+
+def test_format_records_jsonl():
+    lines = "".join(utils.format_records(RECORDS, "jsonl", ["family"])).splitlines()
+
+    assert [json.loads(line) for line in lines] == RECORDS
+
+
+def test_format_records_tsv():
+    output = "".join(utils.format_records(RECORDS, "tsv", ["family", "subsets", "axes", "missing"]))
+
+    assert output == "family\tsubsets\taxes\tmissing\nTest Sans\tlatin,latin-ext\ttag=wght;min=100\t\nTest Serif\t\t\t\n"
+
+
+def test_format_records_is_lazy():
+    def _records():
+        yield RECORDS[0]
+        raise RuntimeError
+
+    chunks = utils.format_records(_records(), "jsonl", [])
+
+    assert json.loads(next(chunks)) == RECORDS[0]
+
+
+def test_format_records_unsupported():
+    with pytest.raises(ValueError):
+        list(utils.format_records(RECORDS, "xml", []))
+
+
+def test_minify_css():
+    css = """/* latin */
+@font-face {
+  font-family: 'Test Sans';
+  font-style: normal;
+  font-weight: 400;
+  src: url(https://example.com/test-sans.woff2) format('woff2');
+  unicode-range: U+0000-00FF, U+0131, U+0152-0153;
+}
+"""
+
+    assert utils.minify_css(css) == (
+        "@font-face{font-family:'Test Sans';font-style:normal;font-weight:400;"
+        "src:url(https://example.com/test-sans.woff2) format('woff2');unicode-range:U+0000-00FF,U+0131,U+0152-0153}"
+    )
+
+
+@pytest.mark.parametrize("family", ["'Test  Sans /* Bold */'", '"Test Sans: Display, Condensed; {x}"'])
+def test_minify_css_keeps_quoted_strings(family):
+    assert utils.minify_css(f"@font-face {{ font-family : {family} ; }}") == f"@font-face{{font-family:{family}}}"
+
+
+def test_minify_css_keeps_data_uris():
+    uri = "data:font/woff2;base64,d09GMgABAAAAA+/9AAoAAAAA=="
+
+    assert utils.minify_css(f"src: url({uri}) format('woff2'), url('{uri}') format('woff2');") == (
+        f"src:url({uri}) format('woff2'),url('{uri}') format('woff2');"
+    )
+
+
+def test_atomic_write(tmp_path):
+    filepath = str(tmp_path / "dir" / "file")
+
+    utils.atomic_write(filepath, b"old")
+    utils.atomic_write(filepath, b"new")
+
+    assert (tmp_path / "dir" / "file").read_bytes() == b"new"
+    assert os.listdir(tmp_path / "dir") == ["file"]
+
+
+def test_atomic_write_follows_umask(tmp_path):
+    umask = os.umask(0o027)
+
+    try:
+        utils.atomic_write(str(tmp_path / "file"), b"gfont")
+    finally:
+        os.umask(umask)
+
+    assert os.stat(tmp_path / "file").st_mode & 0o777 == 0o640
+
+
+def test_atomic_write_failure_keeps_old_content(tmp_path, monkeypatch):
+    utils.atomic_write(str(tmp_path / "file"), b"old")
+
+    def _replace(src, dst):
+        raise OSError("replace failed")
+
+    monkeypatch.setattr(os, "replace", _replace)
+
+    with pytest.raises(OSError):
+        utils.atomic_write(str(tmp_path / "file"), b"new")
+
+    assert (tmp_path / "file").read_bytes() == b"old"
+    assert os.listdir(tmp_path) == ["file"]
+
+
+def test_file_lock(tmp_path):
+    lockpath = str(tmp_path / "locks" / "file.lock")
+    acquired = threading.Event()
+
+    def _lock():
+        with utils.file_lock(lockpath):
+            acquired.set()
+
+    with utils.file_lock(lockpath):
+        thread = threading.Thread(target=_lock)
+        thread.start()
+
+        assert not acquired.wait(0.2)
+
+    thread.join(5)
+
+    assert acquired.is_set()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock, sleeping advances it and is recorded"""
+
+    clock = {"now": 0.0, "sleeps": []}
+
+    def _sleep(seconds):
+        clock["sleeps"].append(seconds)
+        clock["now"] += seconds
+
+    monkeypatch.setattr(utils.time, "monotonic", lambda: clock["now"])
+    monkeypatch.setattr(utils.time, "sleep", _sleep)
+
+    return clock
+
+
+def test_rate_limiter(clock):
+    limiter = utils.RateLimiter(1000)
+
+    # A full bucket allows a burst of {rate} bytes without waiting
+    limiter.consume(500)
+    limiter.consume(500)
+    assert clock["sleeps"] == []
+
+    limiter.consume(1500)
+    assert clock["sleeps"] == [1.5]
+
+    # Waiting time refills the bucket
+    clock["now"] += 0.5
+    limiter.consume(500)
+    assert clock["sleeps"] == [1.5]
+
+
+def test_download_progress(clock, capsys):
+    progress = utils.DownloadProgress("Downloading", 4)
+    progress.start_file(1000)
+    progress.start_file(3000)
+
+    # Two files not started yet are expected to have the average size of started ones, 8000 bytes in total
+    clock["now"] = 2.0
+    progress.update(2000)
+
+    line = capsys.readouterr().out.split("\r")[-2]
+
+    assert line == "Downloading (0/4) 2.0 KiB/7.8 KiB 1000 B/s ETA 6s\033[K"
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, chunks: list):
+        self.status_code = status_code
+        self.chunks = chunks
+        self.headers = {}
+        self.raw = type("Raw", (), {"connection": None})()
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(f"{self.status_code} Error")
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@pytest.mark.parametrize("res", [FakeResponse(503, []), FakeResponse(200, [b"font", ConnectionError("reset")])])
+def test_http_download_closes_response_on_error(monkeypatch, res):
+    monkeypatch.setattr(utils.__session, "get", lambda url, **kwargs: res)
+
+    with pytest.raises((HTTPError, ConnectionError)):
+        utils.http_download("https://example.com/font.ttf")
+
+    assert res.closed
+
+
+def test_http_download(monkeypatch):
+    res = FakeResponse(200, [b"fo", b"nt"])
+    monkeypatch.setattr(utils.__session, "get", lambda url, **kwargs: res)
+
+    assert utils.http_download("https://example.com/font.ttf") == b"font"
+    assert res.closed